@@ -1,4 +1,11 @@
+import random
+import sys
+import time
+from array import array
+
 class Player:
+    __slots__ = ('id', 'name', 'level', 'HP', 'Weapon', 'Armor', 'guild')
+
     def __init__(self, id, name, level, HP, Weapon=None, Armor=None, guild=None):
         self.id = id
         self.name = name
@@ -27,6 +34,10 @@ class Player:
         self.guild = guild
 
 class Weapon:
+    __slots__ = ('name', 'dmg', 'magazine', 'reserve', 'credits')
+
+    magazine_size = 25
+
     def __init__(self, name, dmg, magazine, reserve, credits):
         self.name = name
         self.dmg = dmg
@@ -41,55 +52,319 @@ class Weapon:
         self.magazine -= 1
     
     def reload(self):
-        if (self.reserve == 0):
+        loaded = Weapon.reload_amount(self.reserve)
+        if (loaded == 0):
             return
-        elif (self.reserve > 25):
-            self.magazine = 25
-            self.reserve -= 25
-        else:
-            self.magazine = self.reserve
+
+        self.magazine = loaded
+        self.reserve -= loaded
+
+    @staticmethod
+    def reload_amount(reserve):
+        """จำนวนกระสุนที่ได้จากการ reload หนึ่งครั้ง"""
+        return min(Weapon.magazine_size, reserve)
 
     def animated():
         pass
 
 class Armor:
+    __slots__ = ('name', 'amount', 'max_amount', 'credits', 'regen')
+
+    regen_per_tick = 1
+
     def __init__(self, name, amount, credits, regen=False):
         self.name = name
         self.amount = amount
+        self.max_amount = int(amount)
         self.credits = credits
         self.regen = regen
     
-    def regen_armor():
-        pass
+    def regen_armor(self):
+        if self.regen:
+            self.amount = Armor.regenerated(int(self.amount), self.max_amount)
 
-    def take_damage():
-        pass
+    def take_damage(self, dmg):
+        self.amount, overflow = Armor.absorb(int(self.amount), dmg)
+        return overflow
+
+    @staticmethod
+    def regenerated(amount, max_amount):
+        return min(max_amount, amount + Armor.regen_per_tick)
+
+    @staticmethod
+    def absorb(amount, dmg):
+        """เกราะรับดาเมจก่อน คืนค่า (เกราะที่เหลือ, ดาเมจส่วนที่เกินไปหัก HP)"""
+        absorbed = min(amount, dmg)
+        return amount - absorbed, dmg - absorbed
     
-    def reset():
-        pass
+    def reset(self):
+        self.amount = self.max_amount
 
 class Guild:
+    __slots__ = ('name', 'member', 'guild_master')
+
     def __init__(self, name, guild_master):
         self.name = name
-        self.member = []
+        # dict เรียงตามลำดับที่เข้า guild : player.id -> player
+        self.member = {}
         self.guild_master = guild_master
+
+    @property
+    def member_count(self):
+        return len(self.member)
+
+    def has_member(self, player):
+        return player.id in self.member
     
     def add_member(self, player):
-        self.member.append(player)
+        if player.id in self.member:
+            return False
+
+        self.member[player.id] = player
+        return True
 
     def remove_member(self, player):
-        for i in self.member:
-            if i == player.id:
-                self.member.remove(i)
+        return self.member.pop(player.id, None) is not None
+
+    def transfer_members(self, players, guild):
+        """ย้ายผู้เล่นหลายคนไปอีก guild คืนจำนวนคนที่ย้ายสำเร็จ"""
+        moved = 0
+
+        for player in players:
+            if self.remove_member(player):
+                guild.add_member(player)
+                if player.guild is self:
+                    player.add_guild(guild)
+                moved += 1
+
+        return moved
 
     def info(self):
         print(f"=== Guild Name: {self.name} ===")
         print(f"* Guild Master: {self.guild_master.name} *")
 
-        for data in self.member:
-            print(f"{data.name}")
+        sys.stdout.writelines(f"{data.name}\n" for data in self.member.values())
         print()
 
+class PlayerStore:
+    """เก็บข้อมูลผู้เล่นจำนวนมากแบบ column (struct-of-arrays) และคืน PlayerView แทน object เต็ม"""
+    def __init__(self):
+        self.index = {}
+        self.ids = []
+        self.names = []
+        self.level = array('i')
+        self.HP = array('i')
+        self.weapon_dmg = array('i')
+        self.magazine = array('i')
+        self.reserve = array('i')
+        self.armor = array('i')
+        self.armor_max = array('i')
+        self.regen = array('b')
+        self.guild = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, id, name, level, HP, Weapon=None, Armor=None, guild=None):
+        if id in self.index:
+            return self.get(id)
+
+        self.index[id] = len(self.ids)
+        self.ids.append(id)
+        self.names.append(name)
+        self.level.append(int(level))
+        self.HP.append(int(HP))
+        self.weapon_dmg.append(int(Weapon.dmg) if Weapon else 0)
+        self.magazine.append(int(Weapon.magazine) if Weapon else 0)
+        self.reserve.append(int(Weapon.reserve) if Weapon else 0)
+        self.armor.append(int(Armor.amount) if Armor else 0)
+        self.armor_max.append(Armor.max_amount if Armor else 0)
+        self.regen.append(bool(Armor and Armor.regen))
+        self.guild.append(guild)
+        return PlayerView(self, len(self.ids) - 1)
+
+    def add_player(self, player):
+        return self.add(player.id, player.name, player.level, player.HP,
+                        player.Weapon, player.Armor, player.guild)
+
+    def get(self, id):
+        if id not in self.index:
+            return None
+
+        return PlayerView(self, self.index[id])
+
+    def write_back(self, players):
+        """คัดลอก HP กระสุน และเกราะจาก store กลับไปที่ Player object ที่มี id ตรงกัน"""
+        for player in players:
+            view = self.get(player.id)
+            if view == None:
+                continue
+
+            player.HP = view.HP
+            if player.Weapon:
+                player.Weapon.magazine = view.magazine
+                player.Weapon.reserve = view.reserve
+            if player.Armor:
+                player.Armor.amount = view.armor
+
+    def alive_above_level(self, level):
+        """รหัสผู้เล่นที่ยังไม่ตายและ level มากกว่าที่กำหนด"""
+        return [id for id, hp, lv in zip(self.ids, self.HP, self.level) if hp > 0 and lv > level]
+
+    def top_by_level(self, n):
+        """รหัสผู้เล่น n คนที่ level สูงสุด (ใช้ทำ leaderboard)"""
+        order = sorted(range(len(self.ids)), key=self.level.__getitem__, reverse=True)
+        return [self.ids[i] for i in order[:n]]
+
+class PlayerView:
+    """มุมมองของผู้เล่นหนึ่งคนใน PlayerStore อ่าน/เขียนค่าลง array โดยตรง"""
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    @property
+    def id(self):
+        return self.store.ids[self.row]
+
+    @property
+    def name(self):
+        return self.store.names[self.row]
+
+    @property
+    def level(self):
+        return self.store.level[self.row]
+
+    @level.setter
+    def level(self, value):
+        self.store.level[self.row] = value
+
+    @property
+    def HP(self):
+        return self.store.HP[self.row]
+
+    @HP.setter
+    def HP(self, value):
+        self.store.HP[self.row] = value
+
+    @property
+    def weapon_dmg(self):
+        return self.store.weapon_dmg[self.row]
+
+    @property
+    def magazine(self):
+        return self.store.magazine[self.row]
+
+    @magazine.setter
+    def magazine(self, value):
+        self.store.magazine[self.row] = value
+
+    @property
+    def reserve(self):
+        return self.store.reserve[self.row]
+
+    @reserve.setter
+    def reserve(self, value):
+        self.store.reserve[self.row] = value
+
+    @property
+    def armor(self):
+        return self.store.armor[self.row]
+
+    @armor.setter
+    def armor(self, value):
+        self.store.armor[self.row] = value
+
+    @property
+    def armor_max(self):
+        return self.store.armor_max[self.row]
+
+    @property
+    def regen(self):
+        return bool(self.store.regen[self.row])
+
+    @property
+    def guild(self):
+        return self.store.guild[self.row]
+
+    def death(self):
+        self.HP = 0
+
+    def add_guild(self, guild):
+        self.store.guild[self.row] = guild
+
+class CombatEngine:
+    """จำลองการต่อสู้แบบ tick บน column ของ PlayerStore โดยตรงแทนการเรียก method ทีละ object"""
+    def __init__(self, store, seed=0):
+        self.store = store
+        self.rng = random.Random(seed)
+        self.ticks = 0
+
+    def alive(self):
+        return [i for i, hp in enumerate(self.store.HP) if hp > 0]
+
+    def tick(self):
+        """ทำงานหนึ่ง tick ทุกคนยิงพร้อมกันจากสถานะต้น tick แล้วค่อยคิดดาเมจรวม"""
+        alive = self.alive()
+        if len(alive) < 2:
+            return False
+
+        store = self.store
+        hp, dmg, magazine, reserve = store.HP, store.weapon_dmg, store.magazine, store.reserve
+        armor, armor_max, regen = store.armor, store.armor_max, store.regen
+        incoming = [0] * len(store)
+
+        for i in alive:
+            if dmg[i] == 0:
+                continue
+
+            # กระสุนหมดใช้ tick นี้ reload
+            if magazine[i] == 0:
+                loaded = Weapon.reload_amount(reserve[i])
+                magazine[i] = loaded
+                reserve[i] -= loaded
+                continue
+
+            target = self.rng.choice(alive)
+            while target == i:
+                target = self.rng.choice(alive)
+
+            magazine[i] -= 1
+            incoming[target] += dmg[i]
+
+        for i in alive:
+            armor[i], overflow = Armor.absorb(armor[i], incoming[i])
+            hp[i] = max(0, hp[i] - overflow)
+
+            if regen[i] and hp[i] > 0:
+                armor[i] = Armor.regenerated(armor[i], armor_max[i])
+
+        self.ticks += 1
+        return True
+
+    def run(self, max_ticks=10000):
+        while self.ticks < max_ticks and self.tick():
+            pass
+
+        return self.alive()
+
+    @staticmethod
+    def benchmark(n_players=1000, ticks=100, seed=0):
+        """คืนจำนวน tick ต่อวินาทีของแมตช์ที่มีผู้เล่น n_players คน"""
+        store = PlayerStore()
+        for i in range(n_players):
+            store.add(f"B{i:05}", f"Bot{i}", 1, 100, Weapon("Vandal", 40, 25, 50, 2900),
+                      Armor("Heavy", "50", "1000", i % 2 == 0))
+        engine = CombatEngine(store, seed)
+
+        start = time.perf_counter()
+        while engine.ticks < ticks and engine.tick():
+            pass
+        elapsed = time.perf_counter() - start
+
+        return engine.ticks / elapsed if elapsed else 0
+
 # === Instace Zone === #
 gun1 = Weapon("Vandal", 40, 25, 50, 2900)
 player1 = Player("U001", "Toast", 239, 100, gun1)
@@ -123,4 +398,26 @@ guild_mofu.info()
 guild_oakza.info()
 player1.info()
 player2.info()
-player3.info()
\ No newline at end of file
+player3.info()
+
+# === Combat Zone === #
+store = PlayerStore()
+for player in [player1, player2, player3]:
+    store.add_player(player)
+
+engine = CombatEngine(store, seed=1)
+winner = engine.run()
+store.write_back([player1, player2, player3])
+print(f"=== Combat finished in {engine.ticks} ticks ===")
+for i in winner:
+    print("Winner:", store.names[i], f"(HP: {store.HP[i]})")
+
+# === Player Store Zone === #
+print("Alive players above level 200:", store.alive_above_level(200))
+print("Top level:", store.top_by_level(1))
+
+# === Guild Zone === #
+guild_mofu.add_member(player1)
+guild_mofu.transfer_members([player2], guild_oakza)
+print("MofuNetive members:", guild_mofu.member_count, "| OakZa members:", guild_oakza.member_count)
+guild_oakza.info()
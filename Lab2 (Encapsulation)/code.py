@@ -1,4 +1,6 @@
 class Student:
+    __slots__ = ('__id', '__name')
+
     def __init__(self, student_id, student_name):
         self.__id = student_id
         self.__name = student_name
@@ -10,6 +12,8 @@ class Student:
         return self.__name
     
 class Subject:
+    __slots__ = ('__id', '__name', '__credit', '__teacher')
+
     def __init__(self, subject_id, subject_name, credit):
         self.__id = subject_id
         self.__name = subject_name
@@ -32,6 +36,8 @@ class Subject:
         return self.__credit
 
 class Teacher:
+    __slots__ = ('__id', '__name')
+
     def __init__(self, teacher_id, teacher_name):
         self.__id = teacher_id
         self.__name = teacher_name
@@ -43,6 +49,8 @@ class Teacher:
         return self.__name
 
 class EnrollSubject:
+    __slots__ = ('__student', '__subject', '__grade')
+
     def __init__(self, student, subject):
         self.__student = student
         self.__subject = subject
@@ -67,10 +75,98 @@ class EnrollSubject:
     def assign_grade(self, grade):
         self.__grade = grade
 
+class EnrollmentStore:
+    __slots__ = ('__by_pair', '__by_student', '__by_subject', '__grade_point', '__credit')
+
+    def __init__(self):
+        self.__by_pair = {}
+        self.__by_student = {}
+        self.__by_subject = {}
+
+        # ผลรวมสะสม (เกรด x หน่วยกิต) และหน่วยกิต ของนักศึกษาแต่ละคน
+        self.__grade_point = {}
+        self.__credit = {}
+
+    def get_enroll(self, student, subject):
+        return self.__by_pair.get((student, subject))
+
+    def get_student_enroll(self, student):
+        return self.__by_student.get(student, {}).values()
+
+    def get_subject_enroll(self, subject):
+        return self.__by_subject.get(subject, {}).values()
+
+    def count_subject(self, subject):
+        return len(self.__by_subject.get(subject, {}))
+
+    def enroll(self, student, subject):
+        if (student, subject) in self.__by_pair:
+            return None
+
+        return self.__add(student, subject)
+
+    def enroll_many(self, pairs):
+        # คู่ที่ลงทะเบียนแล้ว (รวมถึงคู่ซ้ำใน pairs) ได้ None เหมือน enroll จึงไม่นับหน่วยกิตซ้ำ
+        return [self.enroll(student, subject) for student, subject in pairs]
+
+    def __add(self, student, subject):
+        enroll = EnrollSubject(student, subject)
+        self.__by_pair[(student, subject)] = enroll
+        self.__by_student.setdefault(student, {})[subject] = enroll
+        self.__by_subject.setdefault(subject, {})[student] = enroll
+
+        self.__grade_point.setdefault(student, 0)
+        self.__credit[student] = self.__credit.get(student, 0) + subject.get_credit()
+        return enroll
+
+    def drop_many(self, pairs):
+        for student, subject in pairs:
+            self.drop(student, subject)
+
+    def drop(self, student, subject):
+        enroll = self.__by_pair.pop((student, subject), None)
+
+        if enroll is not None:
+            del self.__by_student[student][subject]
+            del self.__by_subject[subject][student]
+
+            credit = subject.get_credit()
+            self.__grade_point[student] -= grade_to_count(enroll.get_grade()) * credit
+            self.__credit[student] -= credit
+
+        return enroll
+
+    def assign_grade(self, enroll, grade):
+        credit = enroll.get_subject().get_credit()
+        point = grade_to_count(grade) - grade_to_count(enroll.get_grade())
+
+        enroll.assign_grade(grade)
+        self.__grade_point[enroll.get_student()] += point * credit
+
+    def get_gpa(self, student):
+        credit = self.__credit.get(student, 0)
+
+        if credit == 0:
+            return 0
+
+        return self.__grade_point[student] / credit
+
+    def get_all_gpa(self):
+        # นักศึกษาที่ไม่มีหน่วยกิตเหลือ (เช่นถอนทุกวิชา) ไม่มีเกรดเฉลี่ย จึงไม่นับรวม
+        grade_point = self.__grade_point
+        return {student: grade_point[student] / credit
+                for student, credit in self.__credit.items() if credit}
+
+    def __len__(self):
+        return len(self.__by_pair)
+
+    def __iter__(self):
+        return iter(self.__by_pair.values())
+
 student_list = []
 teacher_list = []
 subject_list = []
-enrollment_list = []
+enrollment_store = EnrollmentStore()
 
 # TODO 1 : function สำหรับค้นหา instance ของวิชาใน subject_list
 def search_subject_by_id(subject_id):
@@ -99,11 +195,9 @@ def enroll_to_subject(student, subject):
     if type(student) != Student or type(subject) != Subject:
         return "Error"
     
-    for enroll in enrollment_list:
-        if enroll.get_student() == student and enroll.get_subject() == subject:
-            return "Already Enrolled"
+    if enrollment_store.enroll(student, subject) is None:
+        return "Already Enrolled"
         
-    enrollment_list.append(EnrollSubject(student, subject))
     return "Done"
 
 # TODO 4 : function สำหรับลบการลงทะเบียน โดยรับ instance ของ student และ subject
@@ -111,30 +205,74 @@ def drop_from_subject(student, subject):
     if type(student) != Student or type(subject) != Subject:
         return "Error"
     
-    for enroll in enrollment_list:
-        if enroll.get_student() == student and enroll.get_subject() == subject:
-            enrollment_list.remove(enroll)
-            return "Done"
+    if enrollment_store.drop(student, subject) is not None:
+        return "Done"
         
     return "Not Found"
 
+# ลงทะเบียนทีละหลายคู่ โดยรับ list ของ (student, subject) และคืนผลลัพธ์ของแต่ละคู่ตามลำดับ
+# ตรวจสอบทั้งหมดก่อน แล้วจึงบันทึกพร้อมกันทีเดียว
+def enroll_many(pairs):
+    result = []
+    new_pairs = []
+    seen = set()
+
+    for student, subject in pairs:
+        if type(student) != Student or type(subject) != Subject:
+            result.append("Error")
+            continue
+
+        if (student, subject) in seen or enrollment_store.get_enroll(student, subject) is not None:
+            result.append("Already Enrolled")
+            continue
+
+        seen.add((student, subject))
+        new_pairs.append((student, subject))
+        result.append("Done")
+
+    enrollment_store.enroll_many(new_pairs)
+    return result
+
+# ยกเลิกการลงทะเบียนทีละหลายคู่ คืนผลลัพธ์ของแต่ละคู่ตามลำดับ
+def drop_many(pairs):
+    result = []
+    drop_pairs = []
+    seen = set()
+
+    for student, subject in pairs:
+        if type(student) != Student or type(subject) != Subject:
+            result.append("Error")
+            continue
+
+        if (student, subject) in seen or enrollment_store.get_enroll(student, subject) is None:
+            result.append("Not Found")
+            continue
+
+        seen.add((student, subject))
+        drop_pairs.append((student, subject))
+        result.append("Done")
+
+    enrollment_store.drop_many(drop_pairs)
+    return result
+
 # TODO 5 : function สำหรับค้นหาการลงทะเบียน โดยรับ instance ของ student และ subject
 def search_enrollment_subject_student(subject, student):
     if type(student) != Student or type(subject) != Subject:
         return "Error"
     
-    for enroll in enrollment_list:
-        if enroll.get_subject() == subject and enroll.get_student() == student:
-            return enroll
+    enroll = enrollment_store.get_enroll(student, subject)
 
-    return "Not Found"
+    if enroll is None:
+        return "Not Found"
+
+    return enroll
 
 # TODO 6 : function สำหรับค้นหาการลงทะเบียนในรายวิชา โดยรับ instance ของ subject
 def search_student_enroll_in_subject(subject):
     if type(subject) != Subject:
         return "Error"
     
-    sub_enroll_lst = [i for i in enrollment_list if i.get_subject() == subject]
+    sub_enroll_lst = list(enrollment_store.get_subject_enroll(subject))
     return sub_enroll_lst
 
 # TODO 7 : function สำหรับค้นหาการลงทะเบียนของนักศึกษาว่ามีวิชาอะไรบ้าง โดยรับ instance ของ student
@@ -142,11 +280,7 @@ def search_subject_that_student_enrolled(student):
     if type(student) != Student:
         return "Error"
 
-    lst_of_student_enroll = []
-
-    for enroll in enrollment_list:
-        if enroll.get_student() == student:
-            lst_of_student_enroll.append(enroll)
+    lst_of_student_enroll = list(enrollment_store.get_student_enroll(student))
     
     if len(lst_of_student_enroll) == 0:
         return "Not Found"
@@ -158,15 +292,16 @@ def assign_grade(student, subject, grade):
     if type(student) != Student and type(subject) != Subject:
         return "Error"
     
-    for enroll in enrollment_list:
-        if enroll.get_subject() == subject and enroll.get_student() == student:
-            if enroll.get_grade() != '':
-                return "Error"
-            
-            enroll.assign_grade(grade)
-            return "Done"
-        
-    return "Not Found"
+    enroll = enrollment_store.get_enroll(student, subject)
+
+    if enroll is None:
+        return "Not Found"
+
+    if enroll.get_grade() != '':
+        return "Error"
+    
+    enrollment_store.assign_grade(enroll, grade)
+    return "Done"
 
 # TODO 9 : function สำหรับคืน instance ของอาจารย์ที่สอนในวิชา
 def get_teacher_teach(subject):
@@ -180,11 +315,7 @@ def get_no_of_student_enrolled(subject):
     if type(subject) != Subject:
         return "Error"
     
-    count_of_enroll = 0
-
-    for enroll in enrollment_list:
-        if enroll.get_subject() == subject:
-            count_of_enroll += 1
+    count_of_enroll = enrollment_store.count_subject(subject)
     
     if count_of_enroll == 0:
         return "Not Found"
@@ -199,9 +330,8 @@ def get_student_record(student):
 
     record = {}
 
-    for enroll in enrollment_list:
-        if enroll.get_student() == student:
-            record[enroll.get_subject().get_id()] = [enroll.get_subject().get_name(), enroll.get_grade()]
+    for enroll in enrollment_store.get_student_enroll(student):
+        record[enroll.get_subject().get_id()] = [enroll.get_subject().get_name(), enroll.get_grade()]
 
     return record
 
@@ -212,18 +342,54 @@ def grade_to_count(grade):
 
 # TODO 12 : function สำหรับคำนวณเกรดเฉลี่ยของนักศึกษา โดยรับ instance ของ student
 def get_student_GPS(student):
-    gps = 0
-    all_credit = 0
+    if type(student) != Student:
+        return "Error"
+
+    return enrollment_store.get_gpa(student)
+
+# คำนวณเกรดเฉลี่ยของนักศึกษาทุกคน คืนค่าเป็น dictionary {รหัส นศ. : เกรดเฉลี่ย}
+def gpa_for_all():
+    return {student.get_id(): gpa for student, gpa in enrollment_store.get_all_gpa().items()}
 
-    subject = get_student_record(student)
+# สรุปผลการเรียนของทุกวิชาใน pass เดียว คืนค่าเป็น dictionary
+# {รหัสวิชา : {'distribution' : {เกรด : จำนวน}, 'mean' : ค่าเฉลี่ยเกรดของผู้ที่ได้เกรดแล้ว}}
+def get_grade_summary():
+    summary = {}
 
-    for id in subject:
-        credit = search_subject_by_id(id).get_credit()
-        grade = grade_to_count(subject[id][1])
-        gps += grade * credit
-        all_credit += credit
+    for subject in subject_list:
+        distribution = {}
+        grade_point = 0
+        graded = 0
+
+        for enroll in enrollment_store.get_subject_enroll(subject):
+            grade = enroll.get_grade()
+            distribution[grade] = distribution.get(grade, 0) + 1
+
+            if grade != '':
+                grade_point += grade_to_count(grade)
+                graded += 1
+
+        summary[subject.get_id()] = {'distribution': distribution,
+                                     'mean': grade_point / graded if graded else 0}
+
+    return summary
 
-    return gps / all_credit
+# เรียงลำดับนักศึกษาตามเกรดเฉลี่ยจากมากไปน้อย คืนค่าเป็น list [(รหัส นศ., เกรดเฉลี่ย)]
+def rank_student_by_GPS():
+    return sorted(gpa_for_all().items(), key=lambda item: item[1], reverse=True)
+
+# คืนเกรดเฉลี่ยที่ตำแหน่ง percentile (0-100) แบบ nearest-rank
+def get_GPS_percentile(percent):
+    if not 0 <= percent <= 100:
+        return "Error"
+
+    all_gpa = sorted(gpa_for_all().values())
+
+    if len(all_gpa) == 0:
+        return "Not Found"
+
+    rank = max(1, -(-percent * len(all_gpa) // 100))
+    return all_gpa[int(rank) - 1]
 
 # ค้นหานักศึกษาลงทะเบียน โดยรับเป็น รหัสวิชา และคืนค่าเป็น dictionary {รหัส นศ. : ชื่อ นศ.}
 def list_student_enrolled_in_subject(subject_id):
@@ -371,4 +537,33 @@ print("")
 # ### Test case #14 : get_student_GPS
 print("Test case #14 get_student_GPS")
 print("Answer : 3.0")
-print("Answer :", get_student_GPS(student_list[1]))
\ No newline at end of file
+print("Answer :", get_student_GPS(student_list[1]))
+print("")
+
+# ### Test case #15 : enroll_many / drop_many
+print("Test case #15 enroll_many / drop_many")
+print("Answer : ['Done', 'Already Enrolled', 'Already Enrolled', 'Error'] ['Done', 'Not Found']")
+print("Answer :", enroll_many([(student_list[5], subject_list[0]), (student_list[5], subject_list[0]),
+                              (student_list[1], subject_list[0]), ('66010006', 'CS101')]),
+      drop_many([(student_list[5], subject_list[0]), (student_list[5], subject_list[0])]))
+print("")
+
+# ### Test case #16 : gpa_for_all
+print("Test case #16 gpa_for_all")
+print("Answer : 2.7142857142857144 0")
+all_gpa = gpa_for_all()
+print("Answer :", all_gpa['66010002'], get_student_GPS(student_list[9]))
+print("")
+
+# ### Test case #17 : get_grade_summary / rank_student_by_GPS / get_GPS_percentile
+print("Test case #17 get_grade_summary / rank_student_by_GPS / get_GPS_percentile")
+print("Answer : {'A': 1, '': 4} 4.0 ('66010002', 2.7142857142857144) 2.7142857142857144")
+summary = get_grade_summary()
+print("Answer :", summary['CS101']['distribution'], summary['CS101']['mean'],
+      rank_student_by_GPS()[0], get_GPS_percentile(100))
+print("")
+
+# ### Test case #18 : gpa_for_all ไม่นับนักศึกษาที่ไม่มีหน่วยกิต
+print("Test case #18 gpa_for_all without students who have no credits")
+print("Answer : False 6")
+print("Answer :", '66010006' in gpa_for_all(), len(rank_student_by_GPS()))
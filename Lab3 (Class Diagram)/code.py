@@ -1,19 +1,152 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+class AccountLock:
+    """lock แบบแบ่ง stripe ตามเลขบัญชี บัญชีที่อยู่คนละ stripe จะไม่แย่ง lock กัน"""
+    __slots__ = ('__locks',)
+
+    def __init__(self, stripes=64):
+        self.__locks = [threading.RLock() for _ in range(stripes)]
+
+    def stripe_of(self, account_number):
+        return hash(account_number) % len(self.__locks)
+
+    @contextmanager
+    def hold(self, *account_numbers):
+        # จอง lock ตามลำดับ stripe เสมอ เพื่อป้องกัน deadlock ตอนโอนเงินสวนทางกัน
+        locks = [self.__locks[i] for i in sorted({self.stripe_of(n) for n in account_numbers})]
+
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+account_locks = AccountLock()
+
+class WithdrawLimitTracker:
+    """วงเงินถอนต่อบัตรแบบ rolling 24 ชั่วโมง เก็บยอดเป็นช่องละชั่วโมง (24 ช่องต่อบัตร)
+    บัตรที่ไม่มีการถอนเกิน 24 ชั่วโมงจะถูกลบออกเอง"""
+    __slots__ = ('__limit', '__bucket_seconds', '__bucket_count', '__cards', '__lock')
+
+    def __init__(self, limit, window_seconds=86400, bucket_count=24):
+        self.__limit = limit
+        self.__bucket_seconds = window_seconds / bucket_count
+        self.__bucket_count = bucket_count
+
+        # เลขบัตร -> [ยอดแต่ละช่อง, ยอดรวม, ช่องล่าสุดที่มีการถอน] เรียงจากบัตรที่ใช้นานที่สุด
+        self.__cards:OrderedDict[str, list] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get_limit(self):
+        return self.__limit
+
+    def __len__(self):
+        return len(self.__cards)
+
+    def __advance(self, usage, bucket):
+        buckets, total, last = usage
+        steps = min(bucket - last, self.__bucket_count)
+
+        for i in range(1, steps + 1):
+            slot = (last + i) % self.__bucket_count
+            total -= buckets[slot]
+            buckets[slot] = 0
+
+        usage[1] = total
+        usage[2] = max(last, bucket)
+
+    def __evict(self, bucket):
+        while self.__cards:
+            card_number, usage = next(iter(self.__cards.items()))
+            if bucket - usage[2] < self.__bucket_count:
+                break
+            del self.__cards[card_number]
+
+    def used(self, card_number, now=None) -> float:
+        """ยอดที่ถอนไปแล้วใน 24 ชั่วโมงล่าสุด"""
+        bucket = int((time.time() if now == None else now) // self.__bucket_seconds)
+
+        with self.__lock:
+            usage = self.__cards.get(card_number)
+            if usage == None:
+                return 0
+
+            self.__advance(usage, bucket)
+            return usage[1]
+
+    def remaining(self, card_number, now=None) -> float:
+        return self.__limit - self.used(card_number, now)
+
+    def consume(self, card_number, amount, now=None) -> bool:
+        """จองวงเงิน amount ถ้ายังไม่เกินวงเงิน คืน False ถ้าเกิน"""
+        bucket = int((time.time() if now == None else now) // self.__bucket_seconds)
+
+        with self.__lock:
+            self.__evict(bucket)
+
+            usage = self.__cards.get(card_number)
+            if usage == None:
+                usage = [[0] * self.__bucket_count, 0, bucket]
+            else:
+                self.__advance(usage, bucket)
+
+            if usage[1] + amount > self.__limit:
+                return False
+
+            usage[0][bucket % self.__bucket_count] += amount
+            usage[1] += amount
+            self.__cards[card_number] = usage
+            self.__cards.move_to_end(card_number)
+            return True
+
+    def release(self, card_number, amount, now=None):
+        """คืนวงเงินที่จองไว้ เมื่อการถอนไม่สำเร็จ"""
+        bucket = int((time.time() if now == None else now) // self.__bucket_seconds)
+
+        with self.__lock:
+            usage = self.__cards.get(card_number)
+            if usage == None:
+                return
+
+            self.__advance(usage, bucket)
+            slot = bucket % self.__bucket_count
+            refund = min(amount, usage[0][slot])
+            usage[0][slot] -= refund
+            usage[1] -= refund
+
 class User:
+    __slots__ = ('__id', '__name', '__account', '__atm_card', '__bank')
+
     def __init__(self, citizen_id: str, name: str):
         self.__id = citizen_id
         self.__name = name
         self.__account:list[Account] = []
         self.__atm_card:list[ATMCard] = []
+        self.__bank = None
     
     def get_name(self):
         return self.__name
     
+    def get_bank(self):
+        return self.__bank
+
+    def set_bank(self, bank):
+        self.__bank = bank
+
     def get_account(self):
         return self.__account
 
     def add_account(self, account):
         self.__account.append(account)
 
+        if self.__bank != None and account.get_atm_card() != None:
+            self.__bank.index_card(account, account.get_atm_card())
+
     def get_atm_card(self):
         return self.__atm_card
     
@@ -21,6 +154,8 @@ class User:
         self.__atm_card.append(atm_card)
 
 class Account:
+    __slots__ = ('__number', '__owner', '__amount', '__atm_card', '__transaction')
+
     def __init__(self, account_number: str, owner: User, init_balance=0):
         self.__number = account_number
         self.__owner = owner
@@ -35,8 +170,13 @@ class Account:
         return self.__atm_card
 
     def set_atm_card(self, atm_card):
+        old_card = self.__atm_card
         self.__atm_card = atm_card
 
+        bank = self.__owner.get_bank()
+        if bank != None:
+            bank.index_card(self, atm_card, old_card)
+
     def get_amount(self):
         return self.__amount
     
@@ -50,38 +190,43 @@ class Account:
         self.__transaction.append(transaction)
     
     def deposit(self, amount, atm_id):
-        self.__amount += amount
-        transaction = Transaction("D", amount, self.__amount, atm_id)
+        with account_locks.hold(self.__number):
+            self.__amount += amount
+            transaction = Transaction("D", amount, self.__amount, atm_id)
 
-        self.add_transaction(transaction)
+            self.add_transaction(transaction)
     
     def withdraw(self, amount, atm_id):
-        if self.__amount < amount:
-            return "Error"
-         
-        self.__amount -= amount
-        transaction = Transaction("W", amount, self.__amount, atm_id)
+        with account_locks.hold(self.__number):
+            if self.__amount < amount:
+                return "Error"
+             
+            self.__amount -= amount
+            transaction = Transaction("W", amount, self.__amount, atm_id)
 
-        self.add_transaction(transaction)
+            self.add_transaction(transaction)
 
     def transfer(self, amount, transfer_acc, atm_id):
-        if self.__amount < amount:
-            return "Can't transfer amount less your account"
-                
-        self.__amount -= amount
-        transfer_acc.balance += amount
+        with account_locks.hold(self.__number, transfer_acc.get_number()):
+            if self.__amount < amount:
+                return "Can't transfer amount less your account"
+                    
+            self.__amount -= amount
+            transfer_acc.balance += amount
 
-        transaction = Transaction("TW", amount, self.__amount, atm_id)
-        self.add_transaction(transaction)
+            transaction = Transaction("TW", amount, self.__amount, atm_id)
+            self.add_transaction(transaction)
 
-        transfer_transaction = Transaction("TD", amount, transfer_acc.balance, atm_id)
-        transfer_acc.add_transaction(transfer_transaction)
+            transfer_transaction = Transaction("TD", amount, transfer_acc.balance, atm_id)
+            transfer_acc.add_transaction(transfer_transaction)
 
         return "Success"
 
     balance = property(get_amount, set_amount)
 
 class ATMCard:
+    __slots__ = ('__number', '__account', '__pin')
+
     def __init__(self, card_number: str, account: Account, pin: str):
         self.__number = card_number
         self.__account = account
@@ -97,6 +242,8 @@ class ATMCard:
         return self.__pin
 
 class ATMMachine:
+    __slots__ = ('__id', '__balance')
+
     max_withdraw = 40000
 
     def __init__(self, machine_id: str, initial_balance: float = 1000000):
@@ -113,15 +260,15 @@ class ATMMachine:
         self.__balance = amount
     
     def insert_card(self, bank, atm_card, pin) -> Account | None:
-        if pin != "1234":
-            return "Invalid PIN"
+        account = bank.find_account_from_card(atm_card)
 
-        for user in bank.get_user():
-            for account in user.get_account():
-                if account.get_atm_card() == atm_card:
-                    return account
+        if account == None:
+            return None
 
-        return None
+        if pin != atm_card.get_pin():
+            return "Invalid PIN"
+
+        return account
 
     def deposit(self, account:Account, amount):
         if amount <= 0:
@@ -140,12 +287,17 @@ class ATMMachine:
         if self.__balance < amount:
             return "ATM has insufficient funds"
         
-        if amount > ATMMachine.max_withdraw:
+        # วงเงินนับรวมทุกเครื่องต่อบัตร บัญชีที่ไม่มีบัตรนับตามเลขบัญชี
+        atm_card = account.get_atm_card()
+        limit_key = atm_card.get_number() if atm_card != None else account.get_number()
+
+        if not withdraw_limits.consume(limit_key, amount):
             return "Exceeds daily withdrawal limit of 40,000 baht"
         
         res = account.withdraw(amount, self.__id)
 
         if res != None:
+            withdraw_limits.release(limit_key, amount)
             return "Error"
         
         self.__balance -= amount
@@ -162,29 +314,70 @@ class ATMMachine:
     
     balance = property(get_amount, set_amount)
 
+# วงเงินถอนต่อบัตรที่ใช้ร่วมกันทุกเครื่อง ATM
+withdraw_limits = WithdrawLimitTracker(ATMMachine.max_withdraw)
+
 class Bank:
+    __slots__ = ('__name', '__users', '__atm_machine', '__card_index', '__card_number_index')
+
     def __init__(self, name: str):
         self.__name = name
         self.__users = []
-        self.__atm_machine = []
+        self.__atm_machine:dict[str, ATMMachine] = {}
+        self.__card_index:dict[ATMCard, Account] = {}
+        self.__card_number_index:dict[str, Account] = {}
 
     def get_user(self):
         return self.__users
     
     def set_users(self, users):
         self.__users = users
+        self.__card_index = {}
+        self.__card_number_index = {}
+
+        for user in users:
+            user.set_bank(self)
+
+            for account in user.get_account():
+                if account.get_atm_card() != None:
+                    self.index_card(account, account.get_atm_card())
+
+    def index_card(self, account, atm_card, old_card=None):
+        if old_card != None and self.__card_index.get(old_card) is account:
+            del self.__card_index[old_card]
+            del self.__card_number_index[old_card.get_number()]
+
+        if atm_card != None:
+            self.__card_index[atm_card] = account
+            self.__card_number_index[atm_card.get_number()] = account
+
+    def find_account_from_card(self, atm_card) -> None | Account:
+        return self.__card_index.get(atm_card)
+
+    def find_account_from_card_number(self, card_number) -> None | Account:
+        return self.__card_number_index.get(card_number)
     
     def get_atm_machine(self, id) -> None | ATMMachine:
-        for machine in self.__atm_machine:
-            if machine.get_id() == id:
-                return machine
-            
-        return None
+        return self.__atm_machine.get(id)
     
+    def get_all_atm_machine(self):
+        return self.__atm_machine.values()
+
     def set_atm_machine(self, atm_machine):
-        self.__atm_machine = atm_machine
+        self.__atm_machine = {}
+        self.add_atm_machines(atm_machine)
+
+    def add_atm_machines(self, atm_machines):
+        for machine in atm_machines:
+            self.__atm_machine[machine.get_id()] = machine
+
+    def remove_atm_machines(self, machine_ids):
+        for id in machine_ids:
+            self.__atm_machine.pop(id, None)
 
 class Transaction:
+    __slots__ = ('__type', '__amount', '__after_amount', '__atm')
+
     def __init__(self, type, amount, after_amount,machine:ATMMachine):
         self.__type = type
         self.__amount = amount
@@ -203,6 +396,35 @@ class Transaction:
     def get_atm_id(self):
         return self.__atm
     
+def benchmark_insert_card(sizes=(10, 1000, 100000), lookups=10000):
+    """วัดเวลาเฉลี่ย (วินาที) ต่อการ insert_card หนึ่งครั้ง เมื่อธนาคารมีจำนวนบัญชีตาม sizes"""
+    result = {}
+
+    for size in sizes:
+        users = []
+        cards = []
+
+        for i in range(size):
+            inst_user = User(str(i), "Bench")
+            inst_account = Account(str(i), inst_user)
+            inst_atm_card = ATMCard(str(i), inst_account, "1234")
+
+            inst_user.add_account(inst_account)
+            inst_account.set_atm_card(inst_atm_card)
+            users.append(inst_user)
+            cards.append(inst_atm_card)
+
+        bank = Bank("Bench")
+        bank.set_users(users)
+        machine = ATMMachine("BENCH")
+
+        start = time.perf_counter()
+        for i in range(lookups):
+            machine.insert_card(bank, cards[(i * 7919) % size], "1234")
+        result[size] = (time.perf_counter() - start) / lookups
+
+    return result
+
 ##################################################################################
 
 #     {     รหัสประชาชน    :[ชื่อ,            หมายเลขบัญชี, หมายเลข ATM, จำนวนเงิน]}
@@ -444,5 +666,60 @@ def test_case():
     print(f"Actual result: {result}")
     print(f"ATM machine balance after: {atm_machine.balance}")
     print("-------------------------")
+    print()
+
+    # Test case #11 : ทดสอบวงเงินถอนต่อวันที่นับรวมทุกเครื่อง ATM
+    print("Test case #11 : Test daily withdrawal limit across ATM machines")
+    atm_1001 = lnwza_bank.get_atm_machine('1001')
+    atm_1002 = lnwza_bank.get_atm_machine('1002')
+    account = atm_1001.insert_card(lnwza_bank, harry_atm_card, harry_atm_card.get_pin())
+    atm_1001.deposit(account, 50000)
+    print("Withdraw 30,000 baht at ATM 1001:", atm_1001.withdraw(account, 30000))
+    print("Withdraw 15,000 baht at ATM 1002:", atm_1002.withdraw(account, 15000))
+    print(f"Expected result: Exceeds daily withdrawal limit of 40,000 baht")
+    print(f"Remaining limit: {withdraw_limits.remaining(harry_atm_card.get_number())}")
+    print("-------------------------")
+    print()
+
+    # Test case #12 : ทดสอบวงเงินแบบ rolling 24 ชั่วโมง การคืนวงเงิน และการลบบัตรที่ไม่ได้ใช้
+    print("Test case #12 : Test rolling window, release and eviction")
+    tracker = WithdrawLimitTracker(ATMMachine.max_withdraw)
+    hour = 3600
+    print("00:00 withdraw 30,000 :", tracker.consume("A", 30000, now=0))
+    print("01:00 withdraw 20,000 :", tracker.consume("A", 20000, now=hour))
+    print("01:00 withdraw 10,000 :", tracker.consume("A", 10000, now=hour))
+    tracker.release("A", 10000, now=hour)
+    print("01:00 used after release :", tracker.used("A", now=hour))
+    print("24:00 withdraw 10,000 :", tracker.consume("A", 10000, now=24 * hour))
+    print("24:00 used :", tracker.used("A", now=24 * hour))
+    tracker.consume("B", 100, now=24 * hour)
+    print("Cards tracked :", len(tracker))
+    tracker.consume("C", 100, now=49 * hour)
+    print("Cards tracked after 49:00 :", len(tracker))
+    print("Expected result: True False True 30000 True 10000 2 1")
+    print("-------------------------")
+    print()
+
+    # Test case #13 : ทดสอบ index บัตร -> บัญชี ของธนาคาร และการตรวจ PIN ของบัตรแต่ละใบ
+    print("Test case #13 : Test card index upkeep and per-card PIN")
+    ron = User('1-1101-12345-14-0', 'Ron Weasley')
+    ron_account = Account('1122334455', ron, 500)
+    ron_card = ATMCard('12347', ron_account, '4321')
+    ron.add_account(ron_account)
+    ron_account.set_atm_card(ron_card)
+    lnwza_bank.set_users(lnwza_bank.get_user() + [ron])
+    atm_machine = lnwza_bank.get_atm_machine('1001')
+    print("Ron card indexed by set_users :", lnwza_bank.find_account_from_card_number('12347') is ron_account)
+    print("Insert with PIN 4321 :", atm_machine.insert_card(lnwza_bank, ron_card, '4321') is ron_account)
+    print("Insert with PIN 1234 :", atm_machine.insert_card(lnwza_bank, ron_card, '1234'))
+
+    new_card = ATMCard('12348', ron_account, '8765')
+    ron_account.set_atm_card(new_card)
+    print("Old card after replace :", atm_machine.insert_card(lnwza_bank, ron_card, '4321'))
+    print("Old card number after replace :", lnwza_bank.find_account_from_card_number('12347'))
+    print("New card after replace :", atm_machine.insert_card(lnwza_bank, new_card, '8765') is ron_account)
+    print("Harry card still indexed :", lnwza_bank.find_account_from_card(harry_atm_card) is not None)
+    print("Expected result: True True Invalid PIN None None True True")
+    print("-------------------------")
 
 test_case()
\ No newline at end of file
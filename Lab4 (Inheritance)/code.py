@@ -1,16 +1,193 @@
+import asyncio
+import copy
+import csv
+import hashlib
+import hmac
+import io
+import itertools
+import json
+import mmap
+import os
+import random
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
 import unittest
+from array import array
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime, timedelta
+from functools import lru_cache
+
+class AccountLock:
+    """lock แบบแบ่ง stripe ตามเลขบัญชี บัญชีที่อยู่คนละ stripe จะไม่แย่ง lock กัน"""
+    __slots__ = ('__locks',)
+
+    def __init__(self, stripes=64):
+        self.__locks = [threading.RLock() for _ in range(stripes)]
+
+    def stripe_of(self, account_number):
+        return hash(account_number) % len(self.__locks)
+
+    @contextmanager
+    def hold(self, *account_numbers):
+        # จอง lock ตามลำดับ stripe เสมอ เพื่อป้องกัน deadlock ตอนโอนเงินสวนทางกัน
+        locks = [self.__locks[i] for i in sorted({self.stripe_of(n) for n in account_numbers})]
+
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    @staticmethod
+    def benchmark(thread_counts=(1, 2, 4, 8), operations=10000) -> dict[int, dict]:
+        """วัดจำนวนรายการต่อวินาทีเมื่อเพิ่มจำนวน thread แต่ละ thread ฝากเงินเข้าบัญชีของตัวเอง
+        สลับกับบัญชีกลางที่ทุก thread ใช้ร่วมกัน และนับยอดที่หายไป (ควรเป็น 0)"""
+        result = {}
+
+        for thread_count in thread_counts:
+            user = User("0000", "Bench")
+            shared = SavingAccount("BENCH-SHARED", user, 0)
+            accounts = [SavingAccount(f"BENCH-{i}", user, 0) for i in range(thread_count)]
+
+            def worker(account):
+                for i in range(operations):
+                    (account if i % 2 else shared).deposit("BENCH", 1)
+
+            threads = [threading.Thread(target=worker, args=(account,)) for account in accounts]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            total = shared.get_balance + sum(account.get_balance for account in accounts)
+            result[thread_count] = {'per_second': thread_count * operations / elapsed if elapsed else 0,
+                                    'lost': thread_count * operations - total}
+
+        return result
+
+account_locks = AccountLock()
+
+class WithdrawLimitTracker:
+    """วงเงินถอนต่อบัตรแบบ rolling 24 ชั่วโมง เก็บยอดเป็นช่องละชั่วโมง (24 ช่องต่อบัตร)
+    บัตรที่ไม่มีการถอนเกิน 24 ชั่วโมงจะถูกลบออกเอง"""
+    __slots__ = ('__limit', '__bucket_seconds', '__bucket_count', '__cards', '__lock')
+
+    def __init__(self, limit, window_seconds=86400, bucket_count=24):
+        self.__limit = limit
+        self.__bucket_seconds = window_seconds / bucket_count
+        self.__bucket_count = bucket_count
+
+        # เลขบัตร -> [ยอดแต่ละช่อง, ยอดรวม, ช่องล่าสุดที่มีการถอน] เรียงจากบัตรที่ใช้นานที่สุด
+        self.__cards:OrderedDict[str, list] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get_limit(self):
+        return self.__limit
+
+    def __len__(self):
+        return len(self.__cards)
+
+    def __advance(self, usage, bucket):
+        buckets, total, last = usage
+        steps = min(bucket - last, self.__bucket_count)
+
+        for i in range(1, steps + 1):
+            slot = (last + i) % self.__bucket_count
+            total -= buckets[slot]
+            buckets[slot] = 0
+
+        usage[1] = total
+        usage[2] = max(last, bucket)
+
+    def __evict(self, bucket):
+        while self.__cards:
+            card_number, usage = next(iter(self.__cards.items()))
+            if bucket - usage[2] < self.__bucket_count:
+                break
+            del self.__cards[card_number]
+
+    def used(self, card_number, now=None) -> float:
+        """ยอดที่ถอนไปแล้วใน 24 ชั่วโมงล่าสุด"""
+        bucket = int((time.time() if now == None else now) // self.__bucket_seconds)
+
+        with self.__lock:
+            usage = self.__cards.get(card_number)
+            if usage == None:
+                return 0
+
+            self.__advance(usage, bucket)
+            return usage[1]
+
+    def remaining(self, card_number, now=None) -> float:
+        return self.__limit - self.used(card_number, now)
+
+    def consume(self, card_number, amount, now=None) -> bool:
+        """จองวงเงิน amount ถ้ายังไม่เกินวงเงิน คืน False ถ้าเกิน"""
+        bucket = int((time.time() if now == None else now) // self.__bucket_seconds)
+
+        with self.__lock:
+            self.__evict(bucket)
+
+            usage = self.__cards.get(card_number)
+            if usage == None:
+                usage = [[0] * self.__bucket_count, 0, bucket]
+            else:
+                self.__advance(usage, bucket)
+
+            if usage[1] + amount > self.__limit:
+                return False
+
+            usage[0][bucket % self.__bucket_count] += amount
+            usage[1] += amount
+            self.__cards[card_number] = usage
+            self.__cards.move_to_end(card_number)
+            return True
+
+    def release(self, card_number, amount, now=None):
+        """คืนวงเงินที่จองไว้ เมื่อการถอนไม่สำเร็จ"""
+        bucket = int((time.time() if now == None else now) // self.__bucket_seconds)
+
+        with self.__lock:
+            usage = self.__cards.get(card_number)
+            if usage == None:
+                return
+
+            self.__advance(usage, bucket)
+            slot = bucket % self.__bucket_count
+            refund = min(amount, usage[0][slot])
+            usage[0][slot] -= refund
+            usage[1] -= refund
 
 class User:
+    __slots__ = ('__id', '__name', '__account_list', '__bank')
+
     def __init__(self, citizen_id: str, name: str):
         self.__id = citizen_id
         self.__name = name
         self.__account_list:list[Account] = []
+        self.__bank = None
     
     @property
     def citizen_id(self):
         return self.__id
 
+    @property
+    def get_bank(self):
+        return self.__bank
+
+    def set_bank(self, bank):
+        self.__bank = bank
+
     @property
     def get_name(self):
         return self.__name
@@ -27,18 +204,25 @@ class User:
             return "Error: Account user does not match"
 
         self.__account_list.append(account)
+
+        if self.__bank != None:
+            self.__bank.index_account(account)
+
         return "Success"
     
     # def add_atm_card(self, atm_card):
     #     self.__atm_card.append(atm_card)
 
 class Account:
+    __slots__ = ('__number', '__owner', '__card', '__balance', '__transaction', '__fee_period')
+
     def __init__(self, account_number: str, owner: User, init_balance=0):
         self.__number = account_number
         self.__owner = owner
         self.__card = None
         self.__balance = init_balance
-        self.__transaction = []
+        self.__transaction = TransactionLedger()
+        self.__fee_period = None
     
     @property
     def get_number(self):
@@ -71,69 +255,125 @@ class Account:
         if card.get_account_number != self.__number:
             return "Error: Card account number does not match"
         
+        old_card = self.__card
         self.__card = card
+
+        bank = self.__owner.get_bank if isinstance(self.__owner, User) else None
+        if bank != None:
+            bank.index_card(self, card, old_card)
+
         return "Success"
     
     def add_transaction(self, transaction):
-        self.__transaction.append(transaction)
+        self.record_transaction(transaction.get_type, transaction.get_amount,
+                                transaction.get_after_amount, transaction.get_atm_id,
+                                transaction.get_timestamp)
+
+    def record_transaction(self, type, amount, after_amount, machine=None, timestamp=None, fee_period=None):
+        """บันทึก transaction ลง ledger และ buffer ของ journal คืน ticket ไว้รอ fsync ด้วย _wait_journal
+        (คืน None ถ้าธนาคารไม่ได้เปิด journal) fee_period ถูกบันทึกลง journal ไว้ใช้ตอน replay"""
+        if timestamp == None:
+            timestamp = time.time()
+
+        self.__transaction.record(type, amount, after_amount, machine, timestamp)
+
+        bank = self.__owner.get_bank if isinstance(self.__owner, User) else None
+        journal = bank.get_journal if bank != None else None
+        if journal == None:
+            return None
+
+        return journal, journal.append(self.__number, type, amount, after_amount, machine, timestamp, fee_period)
+
+    @staticmethod
+    def _wait_journal(*tickets):
+        """รอจน record ของ ticket ถูก fsync ลงไฟล์ ต้องเรียกหลังปล่อย lock บัญชีแล้ว
+        เพื่อไม่ให้บัญชีอื่นใน stripe เดียวกันต้องรอ fsync ไปด้วย"""
+        for ticket in tickets:
+            if ticket != None:
+                journal, seq = ticket
+                journal.wait(seq)
     
     def deposit(self, place, amount):
-        self.__balance += amount
-        transaction = Transaction("D", amount, self.__balance, place)
-
-        self.add_transaction(transaction)
+        with account_locks.hold(self.__number):
+            self.__balance += amount
+            ticket = self.record_transaction("D", amount, self.__balance, place)
 
+        self._wait_journal(ticket)
         return "Success"
     
     def withdraw(self, atm_id, amount):
-        if self.__balance < amount:
-            return "Error : not enough money"
-         
-        self.__balance -= amount
-        transaction = Transaction("W", amount, self.__balance, atm_id)
-
-        self.add_transaction(transaction)
-
+        with account_locks.hold(self.__number):
+            if self.__balance < amount:
+                return "Error : not enough money"
+             
+            self.__balance -= amount
+            ticket = self.record_transaction("W", amount, self.__balance, atm_id)
+
+        self._wait_journal(ticket)
         return "Success"
 
     def transfer(self, amount, transfer_acc, atm_id):
-        if self.__balance < amount:
-            return "Can't transfer amount less your account"
-                
-        self.__balance -= amount
-        transfer_acc.balance += amount
-
-        transaction = Transaction("TW", amount, self.__balance, atm_id)
-        self.add_transaction(transaction)
+        with account_locks.hold(self.__number, transfer_acc.get_number):
+            if self.__balance < amount:
+                return "Can't transfer amount less your account"
+                    
+            self.__balance -= amount
+            transfer_acc.set_balance += amount
 
-        transfer_transaction = Transaction("TD", amount, transfer_acc.balance, atm_id)
-        transfer_acc.add_transaction(transfer_transaction)
+            withdraw_ticket = self.record_transaction("TW", amount, self.__balance, atm_id)
+            deposit_ticket = transfer_acc.record_transaction("TD", amount, transfer_acc.get_balance, atm_id)
 
+        self._wait_journal(withdraw_ticket, deposit_ticket)
         return "Success"
 
     def pay(self, amount, machine_number, cashback):
-        if self.__balance < amount:
-            return "Can't transfer amount less your account"
-        
-        self.__balance -= amount
-        self.__balance += cashback
-        transaction = Transaction("P", amount, self.__balance, machine_number)
-
-        self.add_transaction(transaction)
+        with account_locks.hold(self.__number):
+            if self.__balance < amount:
+                return "Can't transfer amount less your account"
+            
+            self.__balance -= amount
+            self.__balance += cashback
+            ticket = self.record_transaction("P", amount, self.__balance, machine_number)
 
+        self._wait_journal(ticket)
         return "Success"
     
     def deduct_annual_fee(self):
-        if self.__card != None:
-            fee = self.__card.annual_fee
+        # charge_fee จอง lock บัญชีเอง จึงไม่ถือ lock ซ้อนไว้ระหว่างรอ journal
+        card = self.__card
+        if card != None:
+            self.charge_fee(card.annual_fee)
+
+        return "Success"
+
+    @property
+    def get_fee_period(self):
+        return self.__fee_period
+
+    @get_fee_period.setter
+    def set_fee_period(self, period):
+        self.__fee_period = period
+
+    def charge_fee(self, fee, timestamp=None, period=None):
+        """หักค่าธรรมเนียม ถ้าระบุ period จะหักได้ครั้งเดียวต่อ period"""
+        with account_locks.hold(self.__number):
+            if period != None and self.__fee_period == period:
+                return "Error: fee already charged for period"
+
             self.__balance -= fee
+            ticket = self.record_transaction("F", fee, self.__balance, "SYSTEM", timestamp, period)
 
-            transaction = Transaction("F", fee, self.__balance, "SYSTEM")
-            self.add_transaction(transaction)
+            if period != None:
+                self.__fee_period = period
 
+        self._wait_journal(ticket)
         return "Success"
 
 class SavingAccount(Account):
+    __slots__ = ()
+
+    interest_rate = 0.005
+
     def __init__(self, account_number, owner, init_balance=0):
         super().__init__(account_number, owner, init_balance)
 
@@ -141,22 +381,39 @@ class SavingAccount(Account):
         self.set_atm_card(card)
 
     def calculate_interest(self, duration):
-        interest = self.get_balance * 0.005
-        self.set_balance += interest
-        
-        self.add_transaction(Transaction("I", interest, self.set_balance))
+        with account_locks.hold(self.get_number):
+            interest = self.get_balance * SavingAccount.interest_rate
+            self.set_balance += interest
+            
+            ticket = self.record_transaction("I", interest, self.set_balance)
+
+        self._wait_journal(ticket)
         return interest
 
 class FixedAccount(Account):
+    __slots__ = ('__duration_month',)
+
+    # (จำนวนวันขั้นต่ำ, อัตราดอกเบี้ย) เรียงจากมากไปน้อย
+    interest_tiers = ((365, 0.025), (180, 0.0125))
+
     def __init__(self, account_number, owner, month, init_balance=0):
         super().__init__(account_number, owner, init_balance)
         self.__duration_month = month
 
     def withdraw(self, place, amount):
+        # transaction ไม่เคยถูกลบ จึงตรวจก่อนจอง lock ได้ และไม่ถือ lock ซ้อนไว้ระหว่างรอ journal
         if len(self.get_all_transaction) == 0:
             return "Error: No initial deposit"
         return super().withdraw(place, amount)
 
+    @staticmethod
+    def interest_rate_for(duration):
+        for days, rate in FixedAccount.interest_tiers:
+            if duration >= days:
+                return rate
+
+        return 0
+
     @property
     def get_duration_date(self):
         return self.__duration_month
@@ -165,29 +422,87 @@ class FixedAccount(Account):
     def deposit_date(self, date:datetime):
 
         duration = (datetime.now() - date).days
+        rate = FixedAccount.interest_rate_for(duration)
         
         interest = 0
 
-        if duration >= 365:
-            interest = self.get_balance * 0.025
-        elif duration >= 180:
-            interest = self.get_balance * 0.0125
-        
+        with account_locks.hold(self.get_number):
+            if rate != 0:
+                interest = self.get_balance * rate
+                
+            self.set_balance += interest
             
-        self.set_balance += interest
-        
-        self.add_transaction(Transaction("I", interest, self.set_balance))
+            ticket = self.record_transaction("I", interest, self.set_balance)
+
+        self._wait_journal(ticket)
         
 class CurrentAccount(Account):
+    __slots__ = ()
+
     def __init__(self, account_number, owner, init_balance=0):
         super().__init__(account_number, owner, init_balance)
 
+class InterestEngine:
+    """คิดดอกเบี้ยสิ้นวันของหลายบัญชีพร้อมกัน ผลลัพธ์ตรงกับ calculate_interest / deposit_date ของแต่ละบัญชี"""
+
+    @staticmethod
+    def run(saving_accounts=(), fixed_deposits=(), now:datetime=None) -> dict:
+        """saving_accounts: SavingAccount ที่ต้องการคิดดอกเบี้ย
+        fixed_deposits: คู่ (FixedAccount, วันที่ฝาก)"""
+        now = now if now != None else datetime.now()
+
+        accounts = list(saving_accounts)
+        rates = array('d', [SavingAccount.interest_rate]) * len(accounts)
+
+        for account, date in fixed_deposits:
+            accounts.append(account)
+            rates.append(FixedAccount.interest_rate_for((now - date).days))
+
+        balances = array('d', (account.get_balance for account in accounts))
+        interests = array('d', map(float.__mul__, balances, rates))
+
+        timestamp = time.time()
+        total = 0
+        tickets = []
+
+        for account, balance, rate, interest in zip(accounts, balances, rates, interests):
+            with account_locks.hold(account.get_number):
+                # balance เปลี่ยนระหว่างรอบ (มีรายการอื่นเข้ามา) ให้คำนวณใหม่จาก balance ปัจจุบัน
+                if account.get_balance != balance:
+                    interest = account.get_balance * rate
+
+                if rate == 0:
+                    interest = 0
+
+                account.set_balance += interest
+                tickets.append(account.record_transaction("I", interest, account.get_balance, None, timestamp))
+
+            total += interest
+
+        # รอ fsync ครั้งเดียวหลังคิดครบทุกบัญชี
+        Account._wait_journal(*tickets)
+        return {'accounts': len(accounts), 'interest': total}
+
+@lru_cache(maxsize=4096)
+def format_channel(machine):
+    """แปลงรหัสช่องทาง เช่น ATM001 เป็น ATM:001 (ค่าที่มี ':' อยู่แล้วคืนค่าเดิม)"""
+    if ':' in str(machine):
+        return str(machine)
+
+    split_id = ''.join(i for i in str(machine) if i.isdigit())
+    split_place = ''.join(i for i in str(machine) if i.isalpha())
+
+    return f"{split_place}:{split_id}"
+
 class Transaction:
-    def __init__(self, type, amount, after_amount, machine=None):
+    __slots__ = ('__type', '__amount', '__after_amount', '__atm', '__timestamp')
+
+    def __init__(self, type, amount, after_amount, machine=None, timestamp=None):
         self.__type = type
         self.__amount = amount
         self.__after_amount = after_amount
         self.__atm = machine
+        self.__timestamp = timestamp
     
     @property
     def get_type(self):
@@ -197,24 +512,514 @@ class Transaction:
     def get_amount(self):
         return self.__amount
 
+    @property
+    def get_after_amount(self):
+        return self.__after_amount
+
     @property
     def get_atm_id(self):
         return self.__atm
 
-    def __str__(self):
-        if ':' in str(self.__atm):
-            return f"{self.__type}-{self.__atm}-{self.__amount}-{self.__after_amount}"
-        
-        split_id = ''.join(i for i in str(self.__atm) if i.isdigit())
-        split_place = ''.join(i for i in str(self.__atm) if i.isalpha())
+    @property
+    def get_timestamp(self):
+        return self.__timestamp
 
-        return f"{self.__type}-{split_place}:{split_id}-{self.__amount}-{self.__after_amount}"
+    def __str__(self):
+        return f"{self.__type}-{format_channel(self.__atm)}-{self.__amount}-{self.__after_amount}"
     
+class TransactionLedger:
+    """เก็บ transaction แบบ column ใน array และสร้าง Transaction เมื่อถูกเรียกดูเท่านั้น"""
+    __slots__ = ('__types', '__flags', '__amounts', '__after_amounts', '__channel_ids', '__timestamps')
+
+    __INT_AMOUNT = 1
+    __INT_AFTER_AMOUNT = 2
+
+    # ตารางชนิด transaction และชื่อช่องทางใช้ร่วมกันทุก ledger เพื่อไม่ให้แต่ละบัญชีต้องมี list/dict ของตัวเอง
+    __type_names:list[str] = ["D", "W", "TW", "TD", "P", "F", "I"]
+    __type_codes:dict[str, int] = {name: code for code, name in enumerate(__type_names)}
+    __channel_names:list = []
+    __channel_codes:dict = {}
+    __intern_lock = threading.Lock()
+    # รหัสชนิดเก็บใน array('H') จึงมีชนิดได้ไม่เกิน 65536 ชนิด
+    __MAX_TYPES = 1 << 16
+
+    # บัญชีส่วนใหญ่ยังไม่มี transaction จึงชี้ไปที่ array ว่างที่ใช้ร่วมกัน (ไม่มีการ append เข้า array เหล่านี้)
+    __EMPTY_BYTES = array('B')
+    __EMPTY_CODES = array('H')
+    __EMPTY_IDS = array('I')
+    __EMPTY_DOUBLES = array('d')
+
+    def __init__(self):
+        self.__types = TransactionLedger.__EMPTY_CODES
+        self.__flags = TransactionLedger.__EMPTY_BYTES
+        self.__amounts = TransactionLedger.__EMPTY_DOUBLES
+        self.__after_amounts = TransactionLedger.__EMPTY_DOUBLES
+        self.__channel_ids = TransactionLedger.__EMPTY_IDS
+        self.__timestamps = TransactionLedger.__EMPTY_DOUBLES
+
+    def __allocate(self):
+        self.__types = array('H')
+        self.__flags = array('B')
+        self.__amounts = array('d')
+        self.__after_amounts = array('d')
+        self.__channel_ids = array('I')
+        self.__timestamps = array('d')
+
+    @classmethod
+    def type_code(cls, type):
+        """รหัสของชนิด transaction ชนิดใหม่จะถูกเพิ่มเข้าตาราง ใช้ตอนบันทึกเท่านั้น"""
+        code = cls.__type_codes.get(type)
+        if code != None:
+            return code
+
+        with cls.__intern_lock:
+            if type not in cls.__type_codes:
+                if len(cls.__type_names) >= cls.__MAX_TYPES:
+                    raise ValueError("too many transaction types")
+
+                cls.__type_codes[type] = len(cls.__type_names)
+                cls.__type_names.append(type)
+
+            return cls.__type_codes[type]
+
+    @classmethod
+    def find_type_code(cls, type):
+        """รหัสของชนิด transaction ที่มีอยู่แล้ว คืน None ถ้าไม่รู้จัก (ไม่เพิ่มเข้าตาราง)"""
+        return cls.__type_codes.get(type)
+
+    @classmethod
+    def channel_code(cls, machine):
+        code = cls.__channel_codes.get(machine)
+        if code != None:
+            return code
+
+        with cls.__intern_lock:
+            if machine not in cls.__channel_codes:
+                cls.__channel_codes[machine] = len(cls.__channel_names)
+                cls.__channel_names.append(machine)
+
+            return cls.__channel_codes[machine]
+
+    def record(self, type, amount, after_amount, machine=None, timestamp=None):
+        # หารหัสชนิดก่อนแก้ไข column ใด ๆ ถ้าตารางชนิดเต็ม ledger จะไม่ถูกบันทึกไปครึ่งทาง
+        type_code = TransactionLedger.type_code(type)
+        flags = 0
+        if isinstance(amount, int):
+            flags |= TransactionLedger.__INT_AMOUNT
+        if isinstance(after_amount, int):
+            flags |= TransactionLedger.__INT_AFTER_AMOUNT
+
+        if self.__types is TransactionLedger.__EMPTY_CODES:
+            self.__allocate()
+
+        self.__types.append(type_code)
+        self.__flags.append(flags)
+        self.__amounts.append(amount)
+        self.__after_amounts.append(after_amount)
+        self.__channel_ids.append(self.channel_code(machine))
+        self.__timestamps.append(time.time() if timestamp == None else timestamp)
+
+    def append(self, transaction):
+        self.record(transaction.get_type, transaction.get_amount,
+                    transaction.get_after_amount, transaction.get_atm_id,
+                    transaction.get_timestamp)
+
+    @property
+    def types(self):
+        return memoryview(self.__types)
+
+    @property
+    def amounts(self):
+        return memoryview(self.__amounts)
+
+    @property
+    def after_amounts(self):
+        return memoryview(self.__after_amounts)
+
+    @property
+    def channel_ids(self):
+        return memoryview(self.__channel_ids)
+
+    @property
+    def timestamps(self):
+        return memoryview(self.__timestamps)
+
+    @property
+    def channel_names(self):
+        """ชื่อช่องทางที่ ledger นี้ใช้ เรียงตามลำดับที่พบครั้งแรก"""
+        names = TransactionLedger.__channel_names
+        return list(dict.fromkeys(names[code] for code in self.__channel_ids))
+
+    def type_name(self, index):
+        return TransactionLedger.__type_names[self.__types[index]]
+
+    def __len__(self):
+        return len(self.__types)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("transaction index out of range")
+
+        return Transaction(*self.entry(index))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def entry(self, index):
+        """คืนค่า (type, amount, after_amount, machine, timestamp) โดยไม่สร้าง Transaction"""
+        flags = self.__flags[index]
+        amount = self.__amounts[index]
+        after_amount = self.__after_amounts[index]
+
+        if flags & TransactionLedger.__INT_AMOUNT:
+            amount = int(amount)
+        if flags & TransactionLedger.__INT_AFTER_AMOUNT:
+            after_amount = int(after_amount)
+
+        return (self.type_name(index), amount, after_amount,
+                TransactionLedger.__channel_names[self.__channel_ids[index]], self.__timestamps[index])
+
+    def entries(self, start=None, end=None, types=None):
+        """ไล่ entry ทีละรายการ กรองตามช่วงเวลา [start, end) (epoch seconds) และชนิด transaction"""
+        type_codes = None
+        if types != None:
+            type_codes = {TransactionLedger.find_type_code(type) for type in types} - {None}
+
+        for index in range(len(self)):
+            timestamp = self.__timestamps[index]
+
+            if start != None and timestamp < start:
+                continue
+            if end != None and timestamp >= end:
+                continue
+            if type_codes != None and self.__types[index] not in type_codes:
+                continue
+
+            yield self.entry(index)
+
+class TransactionJournal:
+    """บันทึก transaction ลงไฟล์แบบ append-only และ fsync เป็นกลุ่ม (group commit)
+    append เก็บ record ลง buffer แล้วคืนเลขลำดับ ผู้เรียกต้อง wait(เลขลำดับ) ก่อนตอบ "Success"
+    thread แรกที่รอเป็น leader รวม record ที่ค้างอยู่ (จนครบ batch_size หรือครบ max_delay วินาที)
+    แล้วเขียนและ fsync ครั้งเดียว thread อื่นรอผลจาก leader (leader/follower)"""
+    __slots__ = ('__path', '__file', '__batch_size', '__max_delay', '__buffer', '__pending',
+                 '__appended', '__durable', '__flushing', '__cond')
+
+    # flags, ความยาว type, amount, after_amount, timestamp, ความยาวเลขบัญชี, ความยาว machine (-1 คือ None)
+    __HEADER = struct.Struct('<BBdddHh')
+    # ความยาวของ period ค่าธรรมเนียม (JSON) ต่อท้าย record ที่มี flag __FEE_PERIOD
+    __PERIOD = struct.Struct('<H')
+    __INT_AMOUNT = 1
+    __INT_AFTER_AMOUNT = 2
+    __FEE_PERIOD = 4
+
+    def __init__(self, path, batch_size=1000, max_delay=0.002):
+        self.__path = path
+        self.__file = open(path, 'ab')
+        self.__batch_size = batch_size
+        self.__max_delay = max_delay
+        self.__buffer = bytearray()
+        self.__pending = 0
+
+        # __appended คือเลขลำดับ record ล่าสุดที่เข้า buffer, __durable คือเลขลำดับล่าสุดที่ fsync แล้ว
+        self.__appended = 0
+        self.__durable = 0
+        self.__flushing = False
+        self.__cond = threading.Condition()
+
+    @property
+    def path(self):
+        return self.__path
+
+    @property
+    def pending(self):
+        return self.__pending
+
+    def append(self, account_number, type, amount, after_amount, machine=None, timestamp=None, fee_period=None):
+        flags = 0
+        if isinstance(amount, int):
+            flags |= TransactionJournal.__INT_AMOUNT
+        if isinstance(after_amount, int):
+            flags |= TransactionJournal.__INT_AFTER_AMOUNT
+        if fee_period != None:
+            flags |= TransactionJournal.__FEE_PERIOD
+
+        type_bytes = type.encode()
+        account_bytes = str(account_number).encode()
+        machine_bytes = b'' if machine == None else str(machine).encode()
+
+        record = TransactionJournal.__HEADER.pack(
+            flags, len(type_bytes), amount, after_amount,
+            time.time() if timestamp == None else timestamp, len(account_bytes),
+            -1 if machine == None else len(machine_bytes)) + type_bytes + account_bytes + machine_bytes
+
+        if fee_period != None:
+            period_bytes = json.dumps(fee_period).encode()
+            record += TransactionJournal.__PERIOD.pack(len(period_bytes)) + period_bytes
+
+        with self.__cond:
+            self.__buffer += record
+            self.__pending += 1
+            self.__appended += 1
+
+            # ครบ batch แล้วปลุก leader ที่กำลังรอรวม record ให้เขียนทันที
+            if self.__pending >= self.__batch_size:
+                self.__cond.notify_all()
+
+            return self.__appended
+
+    def wait(self, seq):
+        """รอจน record ลำดับ seq ถูก fsync ลงไฟล์"""
+        self.__sync(seq, self.__max_delay)
+
+    def commit(self):
+        """เขียนและ fsync ทุก record ที่ค้างอยู่ทันที"""
+        with self.__cond:
+            seq = self.__appended
+
+        self.__sync(seq, 0)
+
+    def __sync(self, seq, max_delay):
+        with self.__cond:
+            while self.__durable < seq:
+                if self.__flushing:
+                    self.__cond.wait()
+                    continue
+
+                self.__flushing = True
+                deadline = time.monotonic() + max_delay
+
+                while self.__pending < self.__batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.__cond.wait(remaining)
+
+                self.__flush()
+
+    def __flush(self):
+        # เรียกขณะถือ __cond และเป็น leader อยู่ สลับ buffer ออกแล้วปล่อย lock ระหว่างเขียน
+        # ให้ thread อื่น append ต่อได้ การเขียนไฟล์เรียงตามลำดับเพราะมี leader ได้ทีละคน
+        buffer = self.__buffer
+        seq = self.__appended
+        self.__buffer = bytearray()
+        self.__pending = 0
+
+        self.__cond.release()
+        try:
+            self.__file.write(buffer)
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+        finally:
+            self.__cond.acquire()
+            self.__flushing = False
+            self.__cond.notify_all()
+
+        self.__durable = seq
+
+    def close(self):
+        self.commit()
+
+        with self.__cond:
+            self.__file.close()
+
+    @staticmethod
+    def read(path):
+        """อ่าน record ทั้งหมดจากไฟล์ หยุดเมื่อเจอ record ที่เขียนไม่ครบ (เช่นเครื่องดับกลางทาง)"""
+        header = TransactionJournal.__HEADER
+
+        with open(path, 'rb') as file:
+            data = file.read()
+
+        offset = 0
+        while offset + header.size <= len(data):
+            flags, type_len, amount, after_amount, timestamp, account_len, machine_len = \
+                header.unpack_from(data, offset)
+            body = offset + header.size
+            end = body + type_len + account_len + max(machine_len, 0)
+
+            if end > len(data):
+                break
+
+            type = data[body:body + type_len].decode()
+            account_number = data[body + type_len:body + type_len + account_len].decode()
+            machine = None if machine_len < 0 else data[body + type_len + account_len:end].decode()
+            fee_period = None
+
+            if flags & TransactionJournal.__FEE_PERIOD:
+                if end + TransactionJournal.__PERIOD.size > len(data):
+                    break
+
+                period_len, = TransactionJournal.__PERIOD.unpack_from(data, end)
+                period_start = end + TransactionJournal.__PERIOD.size
+                end = period_start + period_len
+
+                if end > len(data):
+                    break
+
+                fee_period = json.loads(data[period_start:end])
+
+            if flags & TransactionJournal.__INT_AMOUNT:
+                amount = int(amount)
+            if flags & TransactionJournal.__INT_AFTER_AMOUNT:
+                after_amount = int(after_amount)
+
+            yield account_number, type, amount, after_amount, machine, timestamp, fee_period
+            offset = end
+
+    @staticmethod
+    def replay(path, bank) -> int:
+        """นำ record ในไฟล์กลับเข้าบัญชีของธนาคาร คืนจำนวน record ที่ replay ได้"""
+        journal = bank.get_journal
+        bank.set_journal(None)
+        count = 0
+
+        try:
+            for account_number, type, amount, after_amount, machine, timestamp, fee_period \
+                    in TransactionJournal.read(path):
+                account = bank.find_account_from_account_number(account_number)
+                if account == None:
+                    continue
+
+                account.set_balance = after_amount
+                account.record_transaction(type, amount, after_amount, machine, timestamp)
+
+                if fee_period != None:
+                    account.set_fee_period = fee_period
+                count += 1
+        finally:
+            bank.set_journal(journal)
+
+        return count
+
+    @staticmethod
+    def benchmark(path, batch_sizes, operations=10000, threads=8):
+        """วัดจำนวน record ต่อวินาทีที่ commit ได้ในแต่ละ batch size เมื่อมีหลาย thread รอ fsync พร้อมกัน"""
+        result = {}
+
+        for batch_size in batch_sizes:
+            if os.path.exists(path):
+                os.remove(path)
+
+            journal = TransactionJournal(path, batch_size)
+
+            def worker():
+                for i in range(operations // threads):
+                    journal.wait(journal.append("BENCH", "D", i, i, "ATM001"))
+
+            workers = [threading.Thread(target=worker) for _ in range(threads)]
+            start = time.perf_counter()
+
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            journal.close()
+
+            elapsed = time.perf_counter() - start
+            result[batch_size] = operations // threads * threads / elapsed if elapsed else 0
+
+        os.remove(path)
+        return result
+
+class PinCache:
+    """cache แบบ LRU ของบัตรที่เพิ่งยืนยัน PIN สำเร็จ มีขนาดจำกัดและหมดอายุตาม ttl (วินาที)
+    เก็บเพียง HMAC ของ PIN ทำให้การทำรายการซ้ำในรอบเดียวกันไม่ต้อง hash PIN แบบเต็มใหม่"""
+    __slots__ = ('__capacity', '__ttl', '__key', '__entries', '__lock')
+
+    def __init__(self, capacity=10000, ttl=300):
+        self.__capacity = capacity
+        self.__ttl = ttl
+        self.__key = os.urandom(32)
+        self.__entries:OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __digest(self, card_number, pin):
+        return hmac.new(self.__key, f"{card_number}:{pin}".encode(), hashlib.sha256).digest()
+
+    def check(self, card_number, pin, now=None) -> bool:
+        now = time.monotonic() if now == None else now
+
+        with self.__lock:
+            entry = self.__entries.get(card_number)
+            if entry == None:
+                return False
+
+            digest, expires = entry
+            if expires <= now:
+                del self.__entries[card_number]
+                return False
+
+            self.__entries.move_to_end(card_number)
+
+        return hmac.compare_digest(digest, self.__digest(card_number, pin))
+
+    def add(self, card_number, pin, now=None):
+        now = time.monotonic() if now == None else now
+        digest = self.__digest(card_number, pin)
+
+        with self.__lock:
+            self.__entries[card_number] = (digest, now + self.__ttl)
+            self.__entries.move_to_end(card_number)
+
+            while len(self.__entries) > self.__capacity:
+                self.__entries.popitem(last=False)
+
+    def discard(self, card_number):
+        with self.__lock:
+            self.__entries.pop(card_number, None)
+
+    @staticmethod
+    def benchmark(card_count=100, rounds=10) -> dict:
+        """วัดจำนวนการยืนยัน PIN ต่อวินาที แบบ hash ทุกครั้งเทียบกับแบบใช้ cache"""
+        cards = [Card(f"BENCH-{i}", f"BENCH-{i}", "1234") for i in range(card_count)]
+        result = {}
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for card in cards:
+                card.validate_pin("1234")
+        elapsed = time.perf_counter() - start
+        result['uncached'] = card_count * rounds / elapsed if elapsed else 0
+
+        cache = PinCache(capacity=card_count)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for card in cards:
+                card.verify_card("1234", cache)
+        elapsed = time.perf_counter() - start
+        result['cached'] = card_count * rounds / elapsed if elapsed else 0
+
+        return result
+
+verified_pins = PinCache()
+
 class Card:
+    __slots__ = ('__number', '__account_number', '__salt', '__pin_hash', '__failed_attempts')
+
+    pin_iterations = 10000
+    max_failed_attempts = 3
+
     def __init__(self, card_number: str, account_number, pin: str):
         self.__number = card_number
         self.__account_number = account_number
-        self.__pin = pin
+
+        # เก็บ PIN เป็น hash พร้อม salt ของแต่ละบัตร PIN ที่ไม่ใช่ตัวเลข 4 หลักจะยืนยันไม่ผ่านเสมอ
+        self.__salt = os.urandom(16)
+        self.__pin_hash = self.__hash_pin(pin) if Card.is_valid_pin(pin) else None
+        self.__failed_attempts = 0
+
+        # บัตรที่ออกใหม่ด้วยเลขเดิมต้องไม่รับ PIN เก่าที่ยังค้างอยู่ใน cache
+        verified_pins.discard(card_number)
     
     @property
     def get_number(self):
@@ -225,20 +1030,69 @@ class Card:
         return self.__account_number
     
     @property
-    def get_pin(self):
-        return self.__pin
+    def get_pin_hash(self):
+        """salt ต่อด้วย hash ของ PIN สำหรับบันทึกลง snapshot"""
+        if self.__pin_hash == None:
+            return None
+        return self.__salt + self.__pin_hash
+
+    def set_pin_hash(self, pin_hash):
+        if pin_hash == None:
+            self.__pin_hash = None
+        else:
+            self.__salt, self.__pin_hash = pin_hash[:16], pin_hash[16:]
+
+        verified_pins.discard(self.__number)
+
+    @property
+    def get_failed_attempts(self):
+        return self.__failed_attempts
+
+    @property
+    def is_locked(self):
+        return self.__failed_attempts >= Card.max_failed_attempts
+
+    def unlock(self):
+        self.__failed_attempts = 0
     
     @property
     def annual_fee(self):
         return 150
+
+    @staticmethod
+    def is_valid_pin(pin):
+        return isinstance(pin, str) and len(pin) == 4 and pin.isdigit()
+
+    def __hash_pin(self, pin):
+        return hashlib.pbkdf2_hmac('sha256', pin.encode(), self.__salt, Card.pin_iterations)
     
     def validate_pin(self, input_pin):
-        return self.__pin == input_pin and len(self.__pin) == 4 and self.__pin.isdigit()
+        if self.__pin_hash == None or not isinstance(input_pin, str):
+            return False
+        return hmac.compare_digest(self.__pin_hash, self.__hash_pin(input_pin))
         
-    def verify_card(self, input_pin):
-        return self.validate_pin(input_pin)
+    def verify_card(self, input_pin, cache=None):
+        cache = verified_pins if cache == None else cache
+
+        if self.is_locked:
+            return False
+
+        if cache.check(self.__number, input_pin):
+            return True
+
+        if self.validate_pin(input_pin):
+            self.__failed_attempts = 0
+            cache.add(self.__number, input_pin)
+            return True
+
+        # ใส่ PIN ผิดครบ max_failed_attempts ครั้งติดกันจะถูกล็อกบัตร
+        self.__failed_attempts += 1
+        cache.discard(self.__number)
+        return False
 
 class DebitCard(Card):
+    __slots__ = ()
+
     def __init__(self, card_number, account, pin):
         super().__init__(card_number, account, pin)
         
@@ -247,18 +1101,24 @@ class DebitCard(Card):
         return 300
 
 class ShoppingDebitCard(DebitCard):
+    __slots__ = ()
+
     cash_back_cost = 1000
 
     def __init__(self, card_number, account_number, pin):
         super().__init__(card_number, account_number, pin)
 
 class TravelDebitCard(DebitCard):
+    __slots__ = ()
+
     insurance_limit = 300000
 
     def __init__(self, card_number, account_number, pin):
         super().__init__(card_number, account_number, pin)
 
 class TransactionChannel:
+    __slots__ = ('__channel_id', '__bank')
+
     def __init__(self, channel_id, bank):
         self.__channel_id = channel_id
         self.__bank = bank
@@ -271,7 +1131,13 @@ class TransactionChannel:
     def bank(self):
         return self.__bank
 
+    @property
+    def machine_id(self):
+        return self.__channel_id
+
 class ATMMachine(TransactionChannel):
+    __slots__ = ('__id', '__balance', '__current_card', '__session')
+
     max_withdraw = 50000
 
     def __init__(self, bank, machine_id: str, initial_balance=10000):
@@ -279,22 +1145,34 @@ class ATMMachine(TransactionChannel):
         self.__id = machine_id
         self.__balance = initial_balance
         self.__current_card = None
+        self.__session = None
 
     @property
     def get_id(self):
         return self.__id
 
+    @property
+    def machine_id(self):
+        return self.__id
+
     @property
     def get_balance(self):
         return self.__balance
     
     @property
     def get_current_card(self):
+        self.__expire_session()
         return self.__current_card
+
+    def __expire_session(self):
+        # session ที่ไม่มีการทำรายการจนหมดเวลาจะคืนบัตรทันทีที่มีการใช้เครื่องครั้งถัดไป
+        if self.__session != None and not self.__session.is_active:
+            self.__session.eject()
     
     def insert_card(self, card, pin) -> Account | str:
         if isinstance(card, (Card, DebitCard)) and card.verify_card(pin):
             self.__current_card = card
+            self.__session = None
             account = self.bank.find_account_from_number(card.get_number)
 
             if isinstance(account, SavingAccount) and account != None:
@@ -302,6 +1180,21 @@ class ATMMachine(TransactionChannel):
             
         return "Error"
 
+    def start_session(self, card, pin, timeout=120) -> 'ATMSession | str':
+        """ใส่บัตรครั้งเดียวแล้วคืน session ที่ผูกบัญชีไว้ ใช้ทำหลายรายการต่อกันได้"""
+        account = self.insert_card(card, pin)
+
+        if account == "Error":
+            return "Error"
+
+        self.__session = ATMSession(self, card, account, timeout)
+        return self.__session
+
+    def eject_card(self, card=None):
+        if card == None or card is self.__current_card:
+            self.__current_card = None
+            self.__session = None
+
     def deposit(self, account:Account, amount):
         if amount <= 0:
             return "Error : amount must be greater than 0"
@@ -313,21 +1206,34 @@ class ATMMachine(TransactionChannel):
         return "Success"
 
     def withdraw(self, account:Account, amount):
-        if amount <= 0 or amount > ATMMachine.max_withdraw:
+        if amount <= 0:
             return "Error"
 
+        if not self.bank.reserve_withdrawal(account, amount):
+            return "Error: Exceeds daily withdrawal limit"
+
         if self.__balance < amount:
+            self.bank.release_withdrawal(account, amount)
             return "ATM has insufficient funds"
         
         res = account.withdraw(self.__id, amount)
 
-        if res != None:
+        if res != "Success":
+            self.bank.release_withdrawal(account, amount)
             return "Error"
         
         self.__balance -= amount
 
         return "Success"
 
+    def replenish(self, amount):
+        if amount <= 0:
+            return "Error"
+
+        self.__balance += amount
+
+        return "Success"
+
     def transfer(self, account:Account, trans_acc:Account, amount):
         if amount <= 0:
             return "Error"
@@ -337,6 +1243,8 @@ class ATMMachine(TransactionChannel):
         return res
 
 class Counter(TransactionChannel):
+    __slots__ = ('__branch_no',)
+
     def __init__(self, bank, branch_no):
         super().__init__(f"COUNTER:{branch_no}",bank)
         self.__branch_no = branch_no
@@ -344,6 +1252,10 @@ class Counter(TransactionChannel):
     @property
     def branch_no(self):
         return self.__branch_no
+
+    @property
+    def machine_id(self):
+        return self.__branch_no
         
     def verify_identity(self, account:Account, account_id, citizen_id):
         if account.get_user.citizen_id == citizen_id and account.get_number == account_id:
@@ -357,113 +1269,1155 @@ class Counter(TransactionChannel):
         return "Error: Invalid identity"
     
     def withdraw(self, account:Account, amount, account_id, citizen_id):
-        if self.verify_identity(account, account_id, citizen_id):
-            return account.withdraw(self.channel_id, amount)
-        return "Error: Invalid identity"
+        if not self.verify_identity(account, account_id, citizen_id):
+            return "Error: Invalid identity"
+
+        if amount > 0 and not self.bank.reserve_withdrawal(account, amount):
+            return "Error: Exceeds daily withdrawal limit"
+
+        res = account.withdraw(self.channel_id, amount)
+
+        if res != "Success" and amount > 0:
+            self.bank.release_withdrawal(account, amount)
+
+        return res
     
     def transfer(self, account:Account, target_account, amount, account_id, citizen_id):
         if self.verify_identity(account, account_id, citizen_id):
-            return account.transfer(self.channel_id, amount, target_account)
+            return account.transfer(amount, target_account, self.channel_id)
         return "Error: Invalid identity"
     
 class EDCMachine(TransactionChannel):
     """ช่องทางการทำรายการผ่านเครื่อง EDC"""
+    __slots__ = ('__edc_no', '__merchant_account', '__current_card', '__current_account',
+                 '__cashback_rate', '__session')
+
+    # อัตรา cashback ตามชนิดบัตร (subclass ได้อัตราเดียวกับ class แม่)
+    cashback_rates = {ShoppingDebitCard: 0.001}
+
     def __init__(self, bank, edc_no, merchant_account:Account):
         super().__init__(f"EDC:{edc_no}", bank)
         self.__edc_no = edc_no
         self.__merchant_account = merchant_account
         self.__current_card = None
+        self.__current_account = None
+        self.__cashback_rate = 0
+        self.__session = None
         
     @property
     def edc_no(self):
         return self.__edc_no
 
+    @property
+    def machine_id(self):
+        return self.__edc_no
+
     @property
     def merchant_account(self):
         return self.__merchant_account
     
     @property
     def get_current_card(self):
+        self.__expire_session()
         return self.__current_card
+
+    @property
+    def get_current_account(self):
+        self.__expire_session()
+        return self.__current_account
+
+    def __expire_session(self):
+        # session ที่ไม่มีการทำรายการจนหมดเวลาจะคืนบัตรทันทีที่มีการใช้เครื่องครั้งถัดไป
+        if self.__session != None and not self.__session.is_active:
+            self.__session.eject()
         
     def swipe_card(self, card, pin):
-        """รูดบัตรและตรวจสอบ PIN"""
+        """รูดบัตรและตรวจสอบ PIN พร้อมค้นหาบัญชีและอัตรา cashback ไว้ใช้ตอนจ่าย"""
         if isinstance(card, DebitCard) and card.verify_card(pin):
             self.__current_card = card
+            self.__current_account = self.bank.find_account_from_number(card.get_number)
+            self.__cashback_rate = EDCMachine.cashback_rate_of(type(card))
+            self.__session = None
             return "Success"
         
         return "Error: Invalid card or PIN"
+
+    def start_session(self, card, pin, timeout=120) -> 'EDCSession | str':
+        """รูดบัตรครั้งเดียวแล้วคืน session ที่ผูกบัญชีไว้ ใช้จ่ายเงินหลายรายการต่อกันได้"""
+        res = self.swipe_card(card, pin)
+
+        if res != "Success":
+            return res
+
+        self.__session = EDCSession(self, card, self.__current_account, timeout)
+        return self.__session
+
+    def eject_card(self, card=None):
+        if card == None or card is self.__current_card:
+            self.__current_card = None
+            self.__current_account = None
+            self.__cashback_rate = 0
+            self.__session = None
         
     def pay(self, debit_card: DebitCard, amount):
-        if self.__current_card == None:
-            return "Error: No card inserted"
-        
-        self.merchant_account.deposit(self.edc_no, amount)
+        res = self.__charge(debit_card, amount)
 
-        account = self.bank.find_account_from_number(debit_card.get_number)
-        cashback =  self.calculate_cashback(debit_card,amount)
-        res = account.pay(amount, self.edc_no, cashback)
+        if res == "Success":
+            self.__credit_merchant(amount)
         
         return res
 
+    def pay_batch(self, payments) -> list[str]:
+        """รับ list ของ (บัตร, PIN, จำนวนเงิน) ตัดเงินลูกค้าทีละรายการ แล้วฝากเข้าบัญชีร้านค้าครั้งเดียว"""
+        result = []
+        total = 0
+
+        for card, pin, amount in payments:
+            res = self.swipe_card(card, pin)
+
+            if res == "Success":
+                res = self.__charge(card, amount)
+                if res == "Success":
+                    total += amount
+
+            result.append(res)
+
+        # ไม่ทิ้งบัตรใบสุดท้ายค้างไว้ในเครื่อง
+        self.eject_card()
+
+        if total > 0:
+            self.__credit_merchant(total)
+
+        return result
+
+    def __credit_merchant(self, amount):
+        # ถ้าธนาคารเปิดใช้ settlement จะพักยอดไว้ แล้วค่อยฝากเข้าร้านค้ารวมทีเดียวตอน settle
+        settlement = self.bank.get_settlement
+        if settlement != None:
+            settlement.add(self.merchant_account, self.edc_no, amount)
+        else:
+            self.merchant_account.deposit(self.edc_no, amount)
+
+    def pay_session(self, session, amount):
+        """ตัดเงินจากบัญชีที่ session ผูกไว้ โดยไม่ค้นหาบัญชีหรือตรวจ PIN ซ้ำ"""
+        if session.get_card == None or session.get_card is not self.get_current_card:
+            return "Error: Card was not swiped"
+
+        res = self.__charge_account(session.get_account, amount, session.get_cashback_rate)
+
+        if res == "Success":
+            self.__credit_merchant(amount)
+
+        return res
+
+    def __charge(self, debit_card, amount):
+        self.__expire_session()
+
+        if self.__current_card == None:
+            return "Error: No card inserted"
+
+        if amount <= 0:
+            return "Error : amount must be greater than 0"
+
+        # ตัดเงินได้เฉพาะบัตรที่รูดและยืนยัน PIN แล้วเท่านั้น
+        if debit_card is not self.__current_card:
+            return "Error: Card was not swiped"
+
+        return self.__charge_account(self.__current_account, amount, self.__cashback_rate)
+
+    def __charge_account(self, account, amount, rate):
+        if amount <= 0:
+            return "Error : amount must be greater than 0"
+
+        if account == None:
+            return "Error: Account not found"
+
+        cashback = amount * rate if amount > ShoppingDebitCard.cash_back_cost and rate != 0 else 0
+
+        # account.pay ตรวจยอดเงินก่อนตัดเงิน ถ้าเงินไม่พอจะไม่มีการเปลี่ยนแปลงใดๆ
+        return account.pay(amount, self.edc_no, cashback)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def cashback_rate_of(card_class):
+        for base in card_class.__mro__:
+            if base in EDCMachine.cashback_rates:
+                return EDCMachine.cashback_rates[base]
+
+        return 0
+
     def calculate_cashback(self, shopping_card, amount):
-        if amount <= ShoppingDebitCard.cash_back_cost or not isinstance(shopping_card, ShoppingDebitCard):
+        rate = EDCMachine.cashback_rate_of(type(shopping_card))
+
+        if amount <= ShoppingDebitCard.cash_back_cost or rate == 0:
             return 0
         
-        return amount * 0.001
+        return amount * rate
         
+class CardSession:
+    """การใช้งานบัตรหนึ่งรอบที่เครื่อง ยืนยัน PIN และค้นหาบัญชีครั้งเดียวตอนเริ่ม
+    จบเมื่อ eject หรือไม่มีการทำรายการนานเกิน timeout (วินาที)"""
+    __slots__ = ('__channel', '__card', '__account', '__timeout', '__expires')
+
+    def __init__(self, channel, card, account, timeout=120):
+        self.__channel = channel
+        self.__card = card
+        self.__account = account
+        self.__timeout = timeout
+        self.__expires = time.monotonic() + timeout
+
+    @property
+    def channel(self):
+        return self.__channel
+
+    @property
+    def get_card(self):
+        return self.__card
+
+    @property
+    def get_account(self):
+        return self.__account
+
+    @property
+    def is_active(self):
+        return self.__card != None and time.monotonic() < self.__expires
+
+    def _begin(self):
+        """ตรวจว่า session ยังใช้งานได้และต่ออายุ คืนข้อความ error ถ้าหมดอายุแล้ว"""
+        if self.__card == None:
+            return "Error: Session closed"
+
+        # มีบัตรอื่นถูกใส่/รูดที่เครื่องนี้แทนแล้ว session นี้จึงใช้ต่อไม่ได้
+        if self.__channel.get_current_card is not self.__card:
+            self.__card = None
+            return "Error: Card was ejected"
+
+        if not self.is_active:
+            self.eject()
+            return "Error: Session expired"
+
+        self.__expires = time.monotonic() + self.__timeout
+        return None
+
+    def eject(self):
+        if self.__card != None:
+            self.__channel.eject_card(self.__card)
+            self.__card = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.eject()
+
+class ATMSession(CardSession):
+    __slots__ = ()
+
+    def deposit(self, amount):
+        return self._begin() or self.channel.deposit(self.get_account, amount)
+
+    def withdraw(self, amount):
+        return self._begin() or self.channel.withdraw(self.get_account, amount)
+
+    def transfer(self, trans_acc:Account, amount):
+        return self._begin() or self.channel.transfer(self.get_account, trans_acc, amount)
+
+class EDCSession(CardSession):
+    __slots__ = ('__cashback_rate',)
+
+    def __init__(self, channel, card, account, timeout=120):
+        super().__init__(channel, card, account, timeout)
+        self.__cashback_rate = EDCMachine.cashback_rate_of(type(card))
+
+    @property
+    def get_cashback_rate(self):
+        return self.__cashback_rate
+
+    def pay(self, amount):
+        return self._begin() or self.channel.pay_session(self, amount)
+
+class ChannelRegistry:
+    """ทะเบียนช่องทางการทำรายการ แยกตามชนิด ค้นหาจาก machine_id ได้แบบ O(1)"""
+    __slots__ = ('__channels',)
+
+    def __init__(self):
+        self.__channels:dict[type, dict[str, TransactionChannel]] = {}
+
+    def register(self, channel) -> str:
+        if not isinstance(channel, TransactionChannel):
+            return "Error"
+
+        self.__channels.setdefault(self.__kind_of(type(channel)), {})[channel.machine_id] = channel
+        return "Success"
+
+    @staticmethod
+    def __kind_of(channel_type) -> type:
+        """คืนคลาสช่องทางหลัก (ATMMachine, Counter, EDCMachine) ของ channel_type เพื่อให้ subclass ถูกเก็บรวมกับชนิดหลัก"""
+        for klass in channel_type.__mro__:
+            if TransactionChannel in klass.__bases__:
+                return klass
+
+        return channel_type
+
+    def register_many(self, channels) -> list[str]:
+        return [self.register(channel) for channel in channels]
+
+    def unregister(self, channel_type, machine_id) -> str:
+        machines = self.__channels.get(self.__kind_of(channel_type))
+
+        if machines == None or machines.pop(machine_id, None) == None:
+            return "Not Found"
+
+        return "Success"
+
+    def unregister_many(self, channel_type, machine_ids) -> list[str]:
+        return [self.unregister(channel_type, machine_id) for machine_id in machine_ids]
+
+    def get(self, channel_type, machine_id):
+        machines = self.__channels.get(self.__kind_of(channel_type))
+
+        if machines == None:
+            return None
+
+        return machines.get(machine_id)
+
+    def channels_of(self, channel_type):
+        """คืน view ของเครื่องตามชนิดหลัก (ไม่ copy) ระบุ subclass ได้ผลเดียวกับชนิดหลักของมัน"""
+        return self.__channels.get(self.__kind_of(channel_type), {}).values()
+
+    def __len__(self):
+        return sum(len(machines) for machines in self.__channels.values())
+
+class MerchantSettlement:
+    """พักยอดขายจาก EDC ของแต่ละร้านค้าไว้ใน array แล้วฝากรวม (netting) เป็นรายการเดียวทุก interval
+    add ตรวจ interval เฉพาะตอนมีรายการเข้ามา ยอดท้ายช่วงที่เงียบจะถูก settle เมื่อเรียก start()
+    ให้มี thread เบื้องหลัง หรือเมื่อผู้ใช้เรียก settle_due()/settle() เอง"""
+    __slots__ = ('__interval', '__max_pending', '__retain', '__pending', '__pending_count', '__edc_names',
+                 '__edc_codes', '__settled', '__last_settle', '__next_receipt', '__next_settlement', '__lock',
+                 '__timer', '__stopped')
+
+    # ทุก settlement ฝากผ่านช่องทางเดียวกัน เพื่อไม่ให้ตารางชื่อช่องทางของ TransactionLedger โตตามจำนวน settlement
+    # เลขที่ settlement ของแต่ละยอดค้นได้จาก receipts_of
+    channel = "SETTLEMENT"
+
+    def __init__(self, interval=60, max_pending=10000, retain=1000):
+        self.__interval = interval
+        self.__max_pending = max_pending
+        # จำนวน settlement ล่าสุดที่เก็บใบเสร็จไว้ให้ค้นได้ (None คือเก็บทั้งหมด)
+        self.__retain = retain
+        # merchant account -> (amounts, edc codes, receipt numbers)
+        self.__pending:dict[Account, tuple[array, array, array]] = {}
+        self.__pending_count = 0
+        self.__edc_names:list = []
+        self.__edc_codes:dict = {}
+        self.__settled:dict[int, tuple[str, array, array, array]] = {}
+        self.__last_settle = time.monotonic()
+        self.__next_receipt = 1
+        self.__next_settlement = 1
+        self.__lock = threading.Lock()
+        self.__timer = None
+        self.__stopped = threading.Event()
+
+    def add(self, merchant_account, edc_no, amount) -> int:
+        """พักยอดหนึ่งรายการ คืนเลขที่ใบเสร็จ"""
+        with self.__lock:
+            if edc_no not in self.__edc_codes:
+                self.__edc_codes[edc_no] = len(self.__edc_names)
+                self.__edc_names.append(edc_no)
+
+            if merchant_account not in self.__pending:
+                self.__pending[merchant_account] = (array('d'), array('I'), array('Q'))
+
+            amounts, edcs, receipts = self.__pending[merchant_account]
+            receipt = self.__next_receipt
+            self.__next_receipt += 1
+
+            amounts.append(amount)
+            edcs.append(self.__edc_codes[edc_no])
+            receipts.append(receipt)
+            self.__pending_count += 1
+
+            due = (self.__pending_count >= self.__max_pending or
+                   time.monotonic() - self.__last_settle >= self.__interval)
+
+        if due:
+            self.settle()
+
+        return receipt
+
+    def pending_amount(self, merchant_account):
+        with self.__lock:
+            if merchant_account not in self.__pending:
+                return 0
+            return sum(self.__pending[merchant_account][0])
+
+    def settle(self) -> list[int]:
+        """ฝากยอดที่พักไว้เข้าบัญชีร้านค้า ร้านละหนึ่งรายการ คืนเลขที่ settlement ที่สร้างขึ้น"""
+        with self.__lock:
+            pending = self.__pending
+            self.__pending = {}
+            self.__pending_count = 0
+            self.__last_settle = time.monotonic()
+
+            settlement_ids = list(range(self.__next_settlement, self.__next_settlement + len(pending)))
+            self.__next_settlement += len(pending)
+
+        for settlement_id, (merchant_account, (amounts, edcs, receipts)) in zip(settlement_ids, pending.items()):
+            merchant_account.deposit(MerchantSettlement.channel, sum(amounts))
+
+            with self.__lock:
+                self.__settled[settlement_id] = (merchant_account.get_number, amounts, edcs, receipts)
+
+        if self.__retain != None:
+            with self.__lock:
+                while len(self.__settled) > self.__retain:
+                    del self.__settled[next(iter(self.__settled))]
+
+        return settlement_ids
+
+    def settle_due(self) -> list[int]:
+        """settle ถ้าครบ interval แล้ว ถ้าไม่มียอดค้างจะเริ่มนับ interval ใหม่"""
+        with self.__lock:
+            due = time.monotonic() - self.__last_settle >= self.__interval
+
+            if due and self.__pending_count == 0:
+                self.__last_settle = time.monotonic()
+                due = False
+
+        return self.settle() if due else []
+
+    def start(self):
+        """เริ่ม thread เบื้องหลังที่เรียก settle_due เมื่อครบ interval แม้ไม่มีรายการใหม่เข้ามา"""
+        if self.__timer != None:
+            return
+
+        self.__stopped.clear()
+        self.__timer = threading.Thread(target=self.__run_timer, daemon=True)
+        self.__timer.start()
+
+    def stop(self):
+        if self.__timer == None:
+            return
+
+        self.__stopped.set()
+        self.__timer.join()
+        self.__timer = None
+
+    def __run_timer(self):
+        while True:
+            with self.__lock:
+                delay = self.__last_settle + self.__interval - time.monotonic()
+
+            if self.__stopped.wait(max(delay, 0)):
+                return
+
+            self.settle_due()
+
+    def prune(self, before_settlement_id) -> int:
+        """ลบใบเสร็จของ settlement ที่มีเลขที่น้อยกว่า before_settlement_id คืนจำนวนที่ลบ"""
+        with self.__lock:
+            expired = [settlement_id for settlement_id in self.__settled if settlement_id < before_settlement_id]
+            for settlement_id in expired:
+                del self.__settled[settlement_id]
+
+        return len(expired)
+
+    def receipts_of(self, settlement_id) -> list[tuple]:
+        """คืนรายการ (เลขที่ใบเสร็จ, เครื่อง EDC, จำนวนเงิน) ที่รวมอยู่ใน settlement"""
+        with self.__lock:
+            if settlement_id not in self.__settled:
+                return []
+
+            _, amounts, edcs, receipts = self.__settled[settlement_id]
+
+        return [(receipt, self.__edc_names[edc], amount) for receipt, edc, amount in zip(receipts, edcs, amounts)]
+
 class Bank:
+    __slots__ = ('__user_list', '__channels', '__card_index', '__account_index', '__citizen_index',
+                 '__journal', '__snapshot', '__snapshot_loaded', '__settlement', '__withdraw_limits')
+
     def __init__(self):
         self.__user_list:list[User] = []
-        self.__atm_machine:list[ATMMachine] = []
-        self.__edc_list:list[EDCMachine] = []
+        self.__channels = ChannelRegistry()
+
+        # index สำหรับค้นหาแบบ O(1) : เลขบัตร, เลขบัญชี, เลขบัตรประชาชน
+        self.__card_index:dict[str, Account] = {}
+        self.__account_index:dict[str, Account] = {}
+        self.__citizen_index:dict[str, User] = {}
+
+        self.__journal:TransactionJournal | None = None
+        self.__snapshot:BankSnapshot | None = None
+        self.__snapshot_loaded = False
+        self.__settlement:MerchantSettlement | None = None
+
+        # วงเงินถอนต่อบัตรแบบ rolling 24 ชั่วโมง นับรวมทุกเครื่องและทุกช่องทางของธนาคาร
+        self.__withdraw_limits = WithdrawLimitTracker(ATMMachine.max_withdraw)
 
     @property
     def get_users(self):
         return self.__user_list
+
+    @property
+    def get_journal(self):
+        return self.__journal
+
+    def set_journal(self, journal):
+        self.__journal = journal
+
+    @property
+    def get_settlement(self):
+        return self.__settlement
+
+    def set_settlement(self, settlement):
+        self.__settlement = settlement
+
+    @property
+    def get_withdraw_limits(self):
+        return self.__withdraw_limits
+
+    def set_withdraw_limits(self, withdraw_limits):
+        self.__withdraw_limits = withdraw_limits
+
+    def reserve_withdrawal(self, account, amount) -> bool:
+        """จองวงเงินถอนของบัตรที่ผูกกับบัญชี บัญชีที่ไม่มีบัตรไม่มีวงเงินต่อวัน"""
+        if account.get_card == None:
+            return True
+        return self.__withdraw_limits.consume(account.get_card.get_number, amount)
+
+    def release_withdrawal(self, account, amount):
+        if account.get_card != None:
+            self.__withdraw_limits.release(account.get_card.get_number, amount)
+
+    @property
+    def get_snapshot(self):
+        return self.__snapshot
+
+    def set_snapshot(self, snapshot):
+        self.__snapshot = snapshot
+        self.__snapshot_loaded = False
+
+    def load_snapshot(self):
+        """สร้างบัญชีที่ยังไม่ถูกโหลดจาก snapshot ให้ครบ ใช้ก่อนทำงานที่ต้องวนทุกบัญชีของธนาคาร"""
+        if self.__snapshot != None and not self.__snapshot_loaded:
+            for account_number in self.__snapshot.account_numbers():
+                self.find_account_from_account_number(account_number)
+            self.__snapshot_loaded = True
     
+    @property
+    def get_channels(self):
+        return self.__channels
+
     def get_atm_machine(self, id) -> ATMMachine | None:
-        for machine in self.__atm_machine:
-            if machine.get_id == id:
-                return machine
-            
-        return None
+        return self.__channels.get(ATMMachine, id)
     
     def get_edc_machine(self, id) -> EDCMachine | None:
-        for machine in self.__edc_list:
-            if machine.edc_no == id:
-                return machine
-        
-        return None
+        return self.__channels.get(EDCMachine, id)
     
     def find_account_from_number(self, card_number):
+        account = self.__card_index.get(card_number)
+
+        if account == None and self.__snapshot != None:
+            account = self.__snapshot.load_card(card_number, self)
+
+        return account
+
+    def find_account_from_account_number(self, account_number):
+        account = self.__account_index.get(account_number)
+
+        if account == None and self.__snapshot != None:
+            account = self.__snapshot.load_account(account_number, self)
+
+        return account
+
+    def iter_accounts(self):
+        self.load_snapshot()
+
         for user in self.__user_list:
-            for account in user.get_account:
-                if account.get_card.get_number == card_number:
-                    return account
-                
-        return None
+            yield from user.get_account
+
+    def find_user_from_citizen_id(self, citizen_id):
+        return self.__citizen_index.get(citizen_id)
+
+    def index_account(self, account):
+        self.__account_index[account.get_number] = account
+
+        if account.get_card != None:
+            self.__card_index[account.get_card.get_number] = account
+
+    def index_card(self, account, card, old_card=None):
+        if old_card != None and self.__card_index.get(old_card.get_number) is account:
+            del self.__card_index[old_card.get_number]
+
+        self.__card_index[card.get_number] = account
 
     def add_user(self, user) -> str:
         if not isinstance(user, User):
             return "Error"
         else:
             self.__user_list.append(user)
+            self.__citizen_index[user.citizen_id] = user
+            user.set_bank(self)
+
+            for account in user.get_account:
+                self.index_account(account)
+
             return "Success"
     
     def add_atm_machine(self, atm_machine) -> str:
         if not isinstance(atm_machine, ATMMachine):
             return "Error"
         else:
-            self.__atm_machine.append(atm_machine)
-            return "Success"
+            return self.__channels.register(atm_machine)
     
     def add_edc_machine(self, edc_machine) -> str:
         if not isinstance(edc_machine, EDCMachine):
             return "Error"
         else:
-            self.__edc_list.append(edc_machine)
-            return "Success"
+            return self.__channels.register(edc_machine)
+
+    def run_annual_fees(self, batch_size=10000, cursor=0, max_batches=None, progress=None, period=None) -> dict:
+        """หักค่าธรรมเนียมรายปีของทุกบัญชีที่มีบัตร ทำทีละ batch
+        period (ค่าเริ่มต้นคือปีปัจจุบัน) ถูกบันทึกไว้ในแต่ละบัญชี บัญชีที่หักใน period นี้แล้วจะถูกข้าม
+        จึงรันซ้ำหลังล้มกลางทางได้โดยไม่หักซ้ำ cursor ใช้เพียงข้ามบัญชีที่ทำไปแล้วเพื่อให้เร็วขึ้น
+        (ถ้ามีการเพิ่มบัญชีระหว่างรอบ ให้เริ่มจาก cursor=0 ด้วย period เดิม)
+        progress(ทำไปแล้ว, ทั้งหมด) ถูกเรียกหลังจบแต่ละ batch"""
+        self.load_snapshot()
+        total = sum(len(user.get_account) for user in self.__user_list)
+        accounts = itertools.islice(self.iter_accounts(), cursor, None)
+
+        # ค่าธรรมเนียมขึ้นกับชนิดบัตร จึงคำนวณครั้งเดียวต่อ class
+        fee_of_class = {}
+        timestamp = time.time()
+        period = datetime.fromtimestamp(timestamp).year if period == None else period
+        charged = 0
+        fees = 0
+        batches = 0
+        start = time.perf_counter()
+
+        while max_batches == None or batches < max_batches:
+            batch = list(itertools.islice(accounts, batch_size))
+            if len(batch) == 0:
+                break
+
+            for account in batch:
+                card = account.get_card
+                if card == None:
+                    continue
+
+                if type(card) not in fee_of_class:
+                    fee_of_class[type(card)] = card.annual_fee
+
+                fee = fee_of_class[type(card)]
+                if account.charge_fee(fee, timestamp, period) != "Success":
+                    continue
+
+                charged += 1
+                fees += fee
+
+            cursor += len(batch)
+            batches += 1
+
+            if progress != None:
+                progress(cursor, total)
+
+        elapsed = time.perf_counter() - start
+        return {'cursor': cursor, 'done': cursor >= total, 'period': period, 'accounts': charged, 'fees': fees,
+                'seconds': elapsed, 'per_second': charged / elapsed if elapsed else 0}
+
+class BankSnapshot:
+    """snapshot ของบัญชีทั้งหมดในไฟล์เดียว เปิดด้วย mmap และสร้าง object เมื่อถูกค้นหาครั้งแรก"""
+    __slots__ = ('__file', '__map', '__version', '__account_count', '__card_count', '__account_index_offset',
+                 '__card_index_offset')
+
+    __MAGIC = b'BNKS'
+    # version 2 เพิ่ม period ค่าธรรมเนียมล่าสุด (JSON) ต่อจาก PIN hash ใน record ของบัญชี
+    __VERSION = 2
+    # magic, version, จำนวนบัญชี, จำนวนบัตร, offset ของ index บัญชี, offset ของ index บัตร
+    __HEADER = struct.Struct('<4sIQQQQ')
+    # key (เลขบัญชี/เลขบัตร) ความยาวไม่เกิน 32 bytes, offset ของ record
+    __INDEX = struct.Struct('<32sQ')
+    # flags, ชนิดบัญชี, ชนิดบัตร, balance, จำนวนเดือน (FixedAccount), จำนวน transaction
+    __RECORD = struct.Struct('<BBBdHI')
+    # flags, amount, after_amount, timestamp
+    __ENTRY = struct.Struct('<Bddd')
+    __STRING = struct.Struct('<H')
+    __NONE = 0xFFFF
+
+    __INT_BALANCE = 1
+    __INT_AMOUNT = 1
+    __INT_AFTER_AMOUNT = 2
+
+    __account_types = [Account, SavingAccount, FixedAccount, CurrentAccount]
+    __card_types = [None, Card, DebitCard, ShoppingDebitCard, TravelDebitCard]
+
+    def __init__(self, path):
+        self.__file = open(path, 'rb')
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.__version, self.__account_count, self.__card_count, \
+            self.__account_index_offset, self.__card_index_offset = BankSnapshot.__HEADER.unpack_from(self.__map, 0)
+
+        if magic != BankSnapshot.__MAGIC or self.__version not in (1, BankSnapshot.__VERSION):
+            self.close()
+            raise ValueError("Not a bank snapshot")
+
+    def __len__(self):
+        return self.__account_count
+
+    def close(self):
+        self.__map.close()
+        self.__file.close()
+
+    @staticmethod
+    def __pack_str(buffer, value):
+        if value == None:
+            buffer += BankSnapshot.__STRING.pack(BankSnapshot.__NONE)
+            return
+
+        data = str(value).encode()
+        buffer += BankSnapshot.__STRING.pack(len(data))
+        buffer += data
+
+    def __unpack_str(self, offset):
+        length, = BankSnapshot.__STRING.unpack_from(self.__map, offset)
+        offset += BankSnapshot.__STRING.size
+
+        if length == BankSnapshot.__NONE:
+            return None, offset
+
+        return self.__map[offset:offset + length].decode(), offset + length
+
+    @staticmethod
+    def save(bank, path) -> str:
+        records = bytearray()
+        account_keys = []
+        card_keys = []
+
+        # iter_accounts โหลดบัญชีที่ยังค้างอยู่ใน snapshot เดิมก่อน จึงไม่มีบัญชีหายไปจาก snapshot ใหม่
+        for account in bank.iter_accounts():
+            user = account.get_user
+            card = account.get_card
+            offset = BankSnapshot.__HEADER.size + len(records)
+
+            key = account.get_number.encode()
+            if len(key) > 32 or (card != None and len(card.get_number.encode()) > 32):
+                return "Error: key too long"
+
+            account_keys.append((key, offset))
+            if card != None:
+                card_keys.append((card.get_number.encode(), offset))
+
+            transactions = account.get_all_transaction
+            records += BankSnapshot.__RECORD.pack(
+                BankSnapshot.__INT_BALANCE if isinstance(account.get_balance, int) else 0,
+                BankSnapshot.__account_types.index(type(account)),
+                BankSnapshot.__card_types.index(type(card) if card != None else None),
+                account.get_balance,
+                account.get_duration_date if isinstance(account, FixedAccount) else 0,
+                len(transactions))
+
+            for value in (account.get_number, user.citizen_id, user.get_name,
+                          card.get_number if card != None else None,
+                          card.get_pin_hash.hex() if card != None and card.get_pin_hash != None else None,
+                          json.dumps(account.get_fee_period) if account.get_fee_period != None else None):
+                BankSnapshot.__pack_str(records, value)
+
+            for transaction_type, amount, after_amount, machine, timestamp in transactions.entries():
+                flags = 0
+                if isinstance(amount, int):
+                    flags |= BankSnapshot.__INT_AMOUNT
+                if isinstance(after_amount, int):
+                    flags |= BankSnapshot.__INT_AFTER_AMOUNT
+
+                records += BankSnapshot.__ENTRY.pack(flags, amount, after_amount, timestamp)
+                BankSnapshot.__pack_str(records, transaction_type)
+                BankSnapshot.__pack_str(records, machine)
+
+        account_keys.sort()
+        card_keys.sort()
+        account_index_offset = BankSnapshot.__HEADER.size + len(records)
+        card_index_offset = account_index_offset + len(account_keys) * BankSnapshot.__INDEX.size
+
+        with open(path, 'wb') as file:
+            file.write(BankSnapshot.__HEADER.pack(BankSnapshot.__MAGIC, BankSnapshot.__VERSION,
+                                                  len(account_keys), len(card_keys),
+                                                  account_index_offset, card_index_offset))
+            file.write(records)
+            for key, offset in account_keys + card_keys:
+                file.write(BankSnapshot.__INDEX.pack(key, offset))
+
+        return "Success"
+
+    def __search(self, index_offset, count, key):
+        key = key.encode()
+        if len(key) > 32:
+            return None
+
+        key = key.ljust(32, b'\0')
+        low, high = 0, count
+
+        while low < high:
+            middle = (low + high) // 2
+            entry_key, offset = BankSnapshot.__INDEX.unpack_from(
+                self.__map, index_offset + middle * BankSnapshot.__INDEX.size)
+
+            if entry_key == key:
+                return offset
+            elif entry_key < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return None
+
+    def account_numbers(self):
+        for i in range(self.__account_count):
+            key, _ = BankSnapshot.__INDEX.unpack_from(self.__map, self.__account_index_offset + i * BankSnapshot.__INDEX.size)
+            yield key.rstrip(b'\0').decode()
+
+    def load_account(self, account_number, bank):
+        offset = self.__search(self.__account_index_offset, self.__account_count, account_number)
+
+        if offset == None:
+            return None
+
+        return self.__materialize(offset, bank)
+
+    def load_card(self, card_number, bank):
+        offset = self.__search(self.__card_index_offset, self.__card_count, card_number)
+
+        if offset == None:
+            return None
+
+        account_number, _ = self.__unpack_str(offset + BankSnapshot.__RECORD.size)
+        account = bank.find_account_from_account_number(account_number)
+
+        # บัตรใบนี้อาจถูกเปลี่ยนไปแล้วหลังจากบัญชีถูกสร้างขึ้นมา
+        if account == None or account.get_card == None or account.get_card.get_number != card_number:
+            return None
+
+        return account
+
+    def __materialize(self, offset, bank):
+        flags, account_type, card_type, balance, month, transaction_count = \
+            BankSnapshot.__RECORD.unpack_from(self.__map, offset)
+        offset += BankSnapshot.__RECORD.size
+
+        values = []
+        for _ in range(5 if self.__version == 1 else 6):
+            value, offset = self.__unpack_str(offset)
+            values.append(value)
+        account_number, citizen_id, name, card_number, pin_hash = values[:5]
+        fee_period = values[5] if len(values) > 5 else None
+
+        if flags & BankSnapshot.__INT_BALANCE:
+            balance = int(balance)
+
+        user = bank.find_user_from_citizen_id(citizen_id)
+        if user == None:
+            user = User(citizen_id, name)
+            bank.add_user(user)
+
+        account_class = BankSnapshot.__account_types[account_type]
+        if account_class == FixedAccount:
+            account = FixedAccount(account_number, user, month, balance)
+        else:
+            account = account_class(account_number, user, balance)
+
+        for _ in range(transaction_count):
+            entry_flags, amount, after_amount, timestamp = BankSnapshot.__ENTRY.unpack_from(self.__map, offset)
+            offset += BankSnapshot.__ENTRY.size
+            type, offset = self.__unpack_str(offset)
+            machine, offset = self.__unpack_str(offset)
+
+            if entry_flags & BankSnapshot.__INT_AMOUNT:
+                amount = int(amount)
+            if entry_flags & BankSnapshot.__INT_AFTER_AMOUNT:
+                after_amount = int(after_amount)
+
+            # บัญชียังไม่ถูกผูกกับ user จึงไม่ถูกบันทึกลง journal ซ้ำ
+            account.get_all_transaction.record(type, amount, after_amount, machine, timestamp)
+
+        if fee_period != None:
+            account.set_fee_period = json.loads(fee_period)
+
+        user.add_account(account)
+
+        if card_type != 0:
+            card = BankSnapshot.__card_types[card_type](card_number, account_number, None)
+            card.set_pin_hash(bytes.fromhex(pin_hash) if pin_hash != None else None)
+            account.set_atm_card(card)
+
+        return account
+
+class StatementExporter:
+    """ส่งออก statement ของหลายบัญชีแบบ streaming (CSV หรือ JSON ทีละบรรทัด) โดยไม่เก็บทั้งหมดไว้ใน memory"""
+    FIELDS = ["account_number", "date", "type", "channel", "amount", "after_amount"]
+
+    @staticmethod
+    def rows(accounts, start:datetime=None, end:datetime=None, types=None):
+        start = start.timestamp() if start != None else None
+        end = end.timestamp() if end != None else None
+
+        for account in accounts:
+            for type, amount, after_amount, machine, timestamp in \
+                    account.get_all_transaction.entries(start, end, types):
+                yield (account.get_number, datetime.fromtimestamp(timestamp).isoformat(),
+                       type, format_channel(machine), amount, after_amount)
+
+    @staticmethod
+    def to_csv(accounts, file, start:datetime=None, end:datetime=None, types=None) -> int:
+        writer = csv.writer(file)
+        writer.writerow(StatementExporter.FIELDS)
+        count = 0
+
+        for row in StatementExporter.rows(accounts, start, end, types):
+            writer.writerow(row)
+            count += 1
+
+        return count
+
+    @staticmethod
+    def to_ndjson(accounts, file, start:datetime=None, end:datetime=None, types=None) -> int:
+        count = 0
+
+        for row in StatementExporter.rows(accounts, start, end, types):
+            file.write(json.dumps(dict(zip(StatementExporter.FIELDS, row))) + "\n")
+            count += 1
+
+        return count
+
+class AsyncAccountLock:
+    """asyncio.Lock ต่อบัญชี ใช้ serialize การทำรายการของบัญชีเดียวกันใน event loop"""
+    __slots__ = ('__locks',)
+
+    def __init__(self):
+        self.__locks:dict[str, asyncio.Lock] = {}
+
+    def lock_of(self, account_number):
+        if account_number not in self.__locks:
+            self.__locks[account_number] = asyncio.Lock()
+
+        return self.__locks[account_number]
+
+    @asynccontextmanager
+    async def hold(self, *account_numbers):
+        # จอง lock ตามลำดับเลขบัญชีเสมอ เพื่อป้องกัน deadlock
+        locks = [self.lock_of(n) for n in sorted(set(account_numbers))]
+
+        for lock in locks:
+            await lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+class AsyncChannel:
+    """ครอบ TransactionChannel ให้เรียกใช้แบบ async ได้ ตัวรายการจริงรันใน worker thread (asyncio.to_thread)
+    event loop จึงไม่ถูก block และ AsyncAccountLock ทำให้รายการของบัญชีเดียวกันรอกันตามลำดับ
+    สถานะของเครื่อง (เงินในตู้, บัตรที่ใส่อยู่) ไม่มี lock ของตัวเอง จึงใช้ได้หนึ่ง AsyncChannel ต่อเครื่อง
+    และทุกรายการของเครื่องนี้ต้องถือ channel lock ด้วย (จองหลัง lock บัญชีเสมอ)"""
+    __slots__ = ('__channel', '__locks', '__channel_lock')
+
+    def __init__(self, channel, locks=None):
+        self.__channel = channel
+        self.__locks = locks if locks != None else AsyncAccountLock()
+        self.__channel_lock = asyncio.Lock()
+
+    @property
+    def channel(self):
+        return self.__channel
+
+    async def __run(self, method, *args):
+        async with self.__channel_lock:
+            return await asyncio.to_thread(method, *args)
+
+    async def insert_card(self, card, pin):
+        return await self.__run(self.__channel.insert_card, card, pin)
+
+    async def swipe_card(self, card, pin):
+        return await self.__run(self.__channel.swipe_card, card, pin)
+
+    async def deposit(self, account:Account, amount, *args):
+        async with self.__locks.hold(account.get_number):
+            return await self.__run(self.__channel.deposit, account, amount, *args)
+
+    async def withdraw(self, account:Account, amount, *args):
+        async with self.__locks.hold(account.get_number):
+            return await self.__run(self.__channel.withdraw, account, amount, *args)
+
+    async def transfer(self, account:Account, target_account:Account, amount, *args):
+        async with self.__locks.hold(account.get_number, target_account.get_number):
+            return await self.__run(self.__channel.transfer, account, target_account, amount, *args)
+
+    async def pay(self, debit_card, amount):
+        # ใช้บัญชีที่เครื่อง EDC ค้นหาไว้ตอนรูดบัตร จึงจอง lock บัญชีเดียวกับ deposit/withdraw
+        # ถ้ามีการรูดบัตรอื่นแทรกก่อนถึงคิว EDCMachine.pay จะปฏิเสธเองเพราะบัตรไม่ตรงกับที่รูดไว้
+        account = self.__channel.get_current_account
+        numbers = [self.__channel.merchant_account.get_number]
+
+        if account != None:
+            numbers.append(account.get_number)
+
+        async with self.__locks.hold(*numbers):
+            return await self.__run(self.__channel.pay, debit_card, amount)
+
+async def simulate_atm_load(terminals, cards, operations, seed=0):
+    """จำลองเครื่อง ATM หลายเครื่องพร้อมกันใน event loop เดียว คืนค่า tps และ latency p50/p99 (วินาที)"""
+    rng = random.Random(seed)
+    latencies = []
+
+    async def run_terminal(terminal:AsyncChannel):
+        for _ in range(operations):
+            card, pin = rng.choice(cards)
+            start = time.perf_counter()
+
+            account = await terminal.insert_card(card, pin)
+            if account != "Error":
+                await terminal.deposit(account, 100)
+                await terminal.withdraw(account, 100)
+
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_terminal(terminal) for terminal in terminals))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {'transactions': len(latencies),
+            'tps': len(latencies) / elapsed if elapsed else 0,
+            'p50': latencies[len(latencies) // 2] if latencies else 0,
+            'p99': latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] if latencies else 0}
+
+class CashForecaster:
+    """จำลองเงินสดในเครื่อง ATM ทั้งธนาคารจาก flow รายวัน (ฝาก - ถอน) ของแต่ละเครื่อง
+    หาวันที่เงินในเครื่องจะต่ำกว่า reserve และวางแผนเติมเงินล่วงหน้า lead_days วัน"""
+    __slots__ = ('__bank', '__capacity', '__reserve', '__lead_days')
+
+    def __init__(self, bank, capacity=1000000, reserve=50000, lead_days=1):
+        self.__bank = bank
+        self.__capacity = capacity
+        self.__reserve = reserve
+        self.__lead_days = lead_days
+
+    def machines(self):
+        return self.__bank.get_channels.channels_of(ATMMachine)
+
+    @staticmethod
+    def synthetic_flows(machine_ids, days=365, mean_withdraw=40000, mean_deposit=15000, seed=0) -> dict[str, array]:
+        """สร้าง flow สุทธิรายวันแบบสุ่มของแต่ละเครื่อง ค่าลบคือเงินสดออกจากเครื่อง"""
+        rng = random.Random(seed)
+        withdraw_rate = 1 / mean_withdraw
+        deposit_rate = 1 / mean_deposit
+
+        return {machine_id: array('d', [rng.expovariate(deposit_rate) - rng.expovariate(withdraw_rate)
+                                        for _ in range(days)])
+                for machine_id in machine_ids}
+
+    def __first_dip(self, flow, day, balance):
+        """วันแรกตั้งแต่ day ที่ยอดคงเหลือสิ้นวันต่ำกว่า reserve หรือ None"""
+        balances = itertools.accumulate(itertools.islice(flow, day, None), initial=balance)
+        next(balances)
+
+        for offset, after in enumerate(balances):
+            if after < self.__reserve:
+                return day + offset
+
+        return None
+
+    def forecast(self, flows) -> dict[str, int | None]:
+        """วันที่เงินแต่ละเครื่องจะต่ำกว่า reserve ถ้าไม่มีการเติมเงิน"""
+        return {machine.machine_id: self.__first_dip(flows[machine.machine_id], 0, machine.get_balance)
+                for machine in self.machines() if machine.machine_id in flows}
+
+    def plan(self, flow, balance) -> tuple[list[tuple[int, float]], list[int]]:
+        """วางแผนเติมเงินของเครื่องเดียว คืน ([(วันที่เติม, จำนวนเงิน)], [วันที่เงินไม่พอจ่าย])"""
+        refills = []
+        shortfalls = []
+        day = 0
+
+        while day < len(flow):
+            dip = self.__first_dip(flow, day, balance)
+            if dip == None:
+                break
+
+            refill_day = max(dip - self.__lead_days, day)
+            balance += sum(itertools.islice(flow, day, refill_day))
+
+            # เครื่องเต็มอยู่แล้วหรือเติมในวันนี้ไปแล้วยังไม่พอ ถือว่าเงินขาดในวันที่ dip
+            if balance >= self.__capacity or (refills and refills[-1][0] == refill_day):
+                balance = max(balance + sum(itertools.islice(flow, refill_day, dip + 1)), 0)
+                shortfalls.append(dip)
+                day = dip + 1
+                continue
+
+            refills.append((refill_day, self.__capacity - balance))
+            balance = self.__capacity
+            day = refill_day
+
+        return refills, shortfalls
+
+    def schedule(self, flows) -> dict[str, dict]:
+        """วางแผนเติมเงินของทุกเครื่องที่มี flow"""
+        result = {}
+
+        for machine in self.machines():
+            flow = flows.get(machine.machine_id)
+            if flow == None:
+                continue
+
+            refills, shortfalls = self.plan(flow, machine.get_balance)
+            result[machine.machine_id] = {'dry_day': self.__first_dip(flow, 0, machine.get_balance),
+                                          'refills': refills, 'shortfalls': shortfalls}
+
+        return result
+
+    def replenish_due(self, schedule, day) -> list[str]:
+        """เติมเงินเข้าเครื่องที่ถึงกำหนดใน day คืนรายชื่อเครื่องที่เติม"""
+        replenished = []
+
+        for machine_id, plan in schedule.items():
+            machine = self.__bank.get_atm_machine(machine_id)
+            if machine == None:
+                continue
+
+            for refill_day, amount in plan['refills']:
+                if refill_day == day and machine.replenish(amount) == "Success":
+                    replenished.append(machine_id)
+
+        return replenished
+
+def benchmark_memory(count=10000) -> dict[str, tuple[float, float]]:
+    """วัดขนาด (bytes ต่อ object) ด้วย tracemalloc ของ object แบบ __slots__ เทียบกับ object ที่เก็บค่าเดียวกันใน __dict__
+    คัดลอกแบบ shallow ทั้งสองแบบ จึงวัดเฉพาะตัว object ไม่รวมค่าที่อ้างถึง"""
+    user = User("0000", "Bench")
+    samples = [Transaction("D", 100, 100, "ATM001", 0.0), Card("BENCH-1", "BENCH", None),
+               ShoppingDebitCard("BENCH-2", "BENCH", None), user, SavingAccount("BENCH", user, 0),
+               FixedAccount("BENCH-F", user, 12, 0)]
+
+    def measure(factory):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        objects = [factory() for _ in range(count)]
+        size = (tracemalloc.get_traced_memory()[0] - before) / count
+        tracemalloc.stop()
+        del objects
+        return size
+
+    result = {}
+    for sample in samples:
+        values = {}
+        for cls in type(sample).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                attribute = f"_{cls.__name__}{name}" if name.startswith('__') else name
+                values[attribute] = getattr(sample, attribute)
+
+        result[type(sample).__name__] = (measure(lambda: copy.copy(sample)),
+                                         measure(lambda: types.SimpleNamespace(**values)))
+
+    return result
 
 ##################################################################################
 class BankingTest(unittest.TestCase):
@@ -1049,6 +3003,801 @@ class BankingTest(unittest.TestCase):
                         "Merchant balance should remain unchanged")
         self.assertEqual(self.tony_savings.get_balance, tony_initial,
                         "Tony's balance should remain unchanged")
-    
+
+    def test_find_account_index(self): # 20. ทดสอบการค้นหาบัญชีจาก index ของธนาคาร
+        """Test O(1) lookup by card number, account number and citizen id"""
+        self.assertIs(self.lnwza_bank.find_account_from_number("4222-2222-2222-2222"), self.steve_savings)
+        self.assertIs(self.lnwza_bank.find_account_from_account_number("CUR001"), self.thanos_current)
+        self.assertIs(self.lnwza_bank.find_user_from_citizen_id("5555-5555-5555"), self.bruce)
+
+        # Card-less account should not crash the lookup
+        self.assertIsNone(self.lnwza_bank.find_account_from_number("0000-0000-0000-0000"))
+
+        # Replacing a card should move the index entry
+        new_card = Card("4999-9999-9999-9999", self.tony_savings.get_number, "1234")
+        self.tony_savings.add_card(new_card)
+        self.assertIs(self.lnwza_bank.find_account_from_number("4999-9999-9999-9999"), self.tony_savings)
+        self.assertIsNone(self.lnwza_bank.find_account_from_number("4111-1111-1111-1111"))
+
+        # Accounts added before the user joins the bank are indexed on add_user
+        wanda = User("7777-7777-7777", "Wanda Maximoff")
+        wanda_savings = SavingAccount("SAV007", wanda, 1000)
+        wanda.add_account(wanda_savings)
+        self.lnwza_bank.add_user(wanda)
+        self.assertIs(self.lnwza_bank.find_account_from_account_number("SAV007"), wanda_savings)
+
+    def test_channel_registry(self): # 21. ทดสอบทะเบียนเครื่อง ATM/EDC
+        """Test keyed registry lookups, bulk register/unregister and per-type views"""
+        registry = self.lnwza_bank.get_channels
+        atms = registry.channels_of(ATMMachine)
+        self.assertEqual(len(atms), 2)
+
+        new_atms = [ATMMachine(self.lnwza_bank, f"ATM{i:03}", 10000) for i in range(3, 6)]
+        self.assertEqual(registry.register_many(new_atms), ["Success"] * 3)
+        self.assertIs(self.lnwza_bank.get_atm_machine("ATM004"), new_atms[1])
+
+        # The view tracks the registry without being copied
+        self.assertEqual(len(atms), 5)
+
+        result = registry.unregister_many(ATMMachine, ["ATM003", "ATM999"])
+        self.assertEqual(result, ["Success", "Not Found"])
+        self.assertIsNone(self.lnwza_bank.get_atm_machine("ATM003"))
+
+        # Same id under a different channel type does not collide
+        self.assertIsNone(self.lnwza_bank.get_edc_machine("ATM001"))
+        self.assertEqual(registry.register("EDC999"), "Error")
+
+    def test_transaction_ledger(self): # 22. ทดสอบ ledger แบบ array
+        """Test the columnar ledger keeps the Transaction view"""
+        self.atm1.deposit(self.tony_savings, 5000)
+        self.tony_savings.withdraw("SYSTEM", 150)
+        self.tony_savings.add_transaction(Transaction("X", 1.5, 2.5, "COUNTER:001"))
+
+        transactions = self.tony_savings.get_all_transaction
+        self.assertEqual(len(transactions), 3)
+        self.assertEqual(str(transactions[0]), "D-ATM:001-5000-105000.0")
+        self.assertEqual(str(transactions[1]), "W-SYSTEM:-150-104850.0")
+        self.assertEqual(str(transactions[-1]), "X-COUNTER:001-1.5-2.5")
+        self.assertEqual([t.get_type for t in transactions], ["D", "W", "X"])
+        self.assertEqual([t.get_type for t in transactions[1:]], ["W", "X"])
+
+        # Balance history is exposed as a flat array for bulk scans
+        self.assertEqual(list(transactions.after_amounts), [105000.0, 104850.0, 2.5])
+        self.assertEqual(transactions.channel_names, ["ATM001", "SYSTEM", "COUNTER:001"])
+
+    def test_slotted_domain_objects(self): # 23. ทดสอบว่า object ไม่มี __dict__
+        """Test domain objects are slotted and keep their property API"""
+        fixed = FixedAccount("FIX099", self.tony, 6, 100)
+        objects = [self.tony, self.tony_savings, fixed, self.thanos_current,
+                   self.tony_atm_card, self.steve_shopping_card, self.thor_travel_card,
+                   Transaction("D", 1, 1), self.atm1, self.counter,
+                   self.lnwza_bank.get_edc_machine("EDC001"), self.lnwza_bank]
+
+        for obj in objects:
+            self.assertFalse(hasattr(obj, "__dict__"), f"{type(obj).__name__} should not have __dict__")
+
+        self.assertEqual(fixed.get_duration_date, 6)
+        self.assertEqual(self.steve_shopping_card.annual_fee, 300)
+        self.assertEqual(self.steve_shopping_card.get_account_number, "SAV002")
+
+        for name, (slotted, with_dict) in benchmark_memory(count=1000).items():
+            self.assertLess(slotted, with_dict, f"Slotted {name} should be smaller than a __dict__ object")
+
+    def test_concurrent_balance_update(self): # 24. ทดสอบการฝาก/โอนเงินพร้อมกันหลาย thread
+        """Test striped account locks keep every update and never deadlock on crossing transfers"""
+        tony_initial = self.tony_savings.get_balance
+        steve_initial = self.steve_savings.get_balance
+
+        def worker(i):
+            for _ in range(500):
+                self.tony_savings.deposit("COUNTER:001", 1)
+                if i % 2 == 0:
+                    self.tony_savings.transfer(10, self.steve_savings, "COUNTER:001")
+                else:
+                    self.steve_savings.transfer(10, self.tony_savings, "COUNTER:001")
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+            self.assertFalse(thread.is_alive(), "Transfers should not deadlock")
+
+        self.assertEqual(self.tony_savings.get_balance + self.steve_savings.get_balance,
+                         tony_initial + steve_initial + 8 * 500)
+        self.assertEqual(len(self.tony_savings.get_all_transaction), 8 * 500 + 8 * 500)
+
+        report = AccountLock.benchmark(thread_counts=(1, 4), operations=500)
+        self.assertEqual([report[n]['lost'] for n in (1, 4)], [0, 0], "No update is lost under contention")
+
+    def test_async_atm_load(self): # 25. ทดสอบการทำรายการผ่าน ATM แบบ async หลายเครื่องพร้อมกัน
+        """Test many async terminals against shared accounts"""
+        tony_initial = self.tony_savings.get_balance
+        # ทดสอบ throughput ไม่ใช่วงเงินต่อวัน จึงไม่จำกัดวงเงินถอน
+        self.lnwza_bank.set_withdraw_limits(WithdrawLimitTracker(float('inf')))
+        locks = AsyncAccountLock()
+        atms = [ATMMachine(self.lnwza_bank, f"ATM{i:03}", 100000) for i in range(100)]
+        terminals = [AsyncChannel(atm, locks) for atm in atms]
+        cards = [(self.tony_atm_card, "1234"), (self.steve_shopping_card, "5678")]
+
+        report = asyncio.run(simulate_atm_load(terminals, cards, 10))
+
+        self.assertEqual(report['transactions'], 1000)
+        self.assertGreater(report['tps'], 0)
+        self.assertLessEqual(report['p50'], report['p99'])
+        self.assertEqual(self.tony_savings.get_balance, tony_initial,
+                         "Each deposit is matched by a withdrawal")
+        self.assertEqual(sum(atm.get_balance for atm in atms), 100 * 100000)
+
+    def test_journal_replay(self): # 26. ทดสอบการบันทึก journal และ replay หลังระบบล่ม
+        """Test journaled transactions are recovered into a freshly built bank"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bank.wal")
+            journal = TransactionJournal(path, batch_size=2)
+            self.lnwza_bank.set_journal(journal)
+
+            self.atm1.deposit(self.tony_savings, 5000)
+            self.tony_savings.deduct_annual_fee()
+            self.thor_savings.calculate_interest(1)
+            self.assertEqual(journal.pending, 0, "Every acknowledged record is already durable")
+            self.assertEqual(len(list(TransactionJournal.read(path))), 3,
+                             "Records reach the file without waiting for a full batch or close()")
+            journal.close()
+
+            # Simulate a torn write at the tail of the log
+            with open(path, 'ab') as file:
+                file.write(b'\x00\x01')
+
+            bank = Bank()
+            tony = User("1111-1111-1111", "Tony Stark")
+            thor = User("3333-3333-3333", "Thor Odinson")
+            bank.add_user(tony)
+            bank.add_user(thor)
+            tony_savings = SavingAccount("SAV001", tony, 100000.00)
+            thor_savings = SavingAccount("SAV003", thor, 150000.00)
+            tony.add_account(tony_savings)
+            thor.add_account(thor_savings)
+
+            self.assertEqual(TransactionJournal.replay(path, bank), 3)
+
+        self.assertEqual(tony_savings.get_balance, self.tony_savings.get_balance)
+        self.assertEqual(thor_savings.get_balance, self.thor_savings.get_balance)
+        self.assertEqual([str(t) for t in tony_savings.get_all_transaction],
+                         [str(t) for t in self.tony_savings.get_all_transaction])
+
+    def test_snapshot_lazy_load(self): # 27. ทดสอบการโหลดธนาคารจาก snapshot
+        """Test a bank restored from a snapshot builds accounts only when first touched"""
+        self.atm1.deposit(self.tony_savings, 5000)
+        tony_current = CurrentAccount("CUR002", self.tony, 42)
+        self.tony.add_account(tony_current)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bank.snapshot")
+            self.assertEqual(BankSnapshot.save(self.lnwza_bank, path), "Success")
+
+            bank = Bank()
+            snapshot = BankSnapshot(path)
+            bank.set_snapshot(snapshot)
+            self.assertEqual(len(snapshot), 7)
+            self.assertEqual(len(bank.get_users), 0, "Nothing is built before the first lookup")
+
+            atm = ATMMachine(bank, "ATM009", 10000)
+            account = atm.insert_card(self.tony_atm_card, "1234")
+            self.assertIsInstance(account, SavingAccount)
+            self.assertEqual(account.get_balance, self.tony_savings.get_balance)
+            self.assertEqual([str(t) for t in account.get_all_transaction],
+                             [str(t) for t in self.tony_savings.get_all_transaction])
+            self.assertEqual(len(bank.get_users), 1)
+
+            current = bank.find_account_from_account_number("CUR002")
+            self.assertIsInstance(current, CurrentAccount)
+            self.assertIs(current.get_user, account.get_user, "Accounts of one citizen share a User")
+            self.assertEqual(current.get_balance, 42)
+
+            fixed = bank.find_account_from_account_number("FIX001")
+            self.assertEqual(fixed.get_duration_date, 12)
+            self.assertIsInstance(bank.find_account_from_number("4222-2222-2222-2222").get_card, ShoppingDebitCard)
+            self.assertIsNone(bank.find_account_from_number("0000"))
+
+            snapshot.close()
+
+    def test_statement_export(self): # 28. ทดสอบการส่งออก statement
+        """Test streaming statement export with date and type filters"""
+        last_year = datetime.now() - timedelta(days=365)
+        self.tony_savings.add_transaction(Transaction("D", 100, 100100.0, "ATM001", last_year.timestamp()))
+        self.atm1.deposit(self.tony_savings, 5000)
+        self.tony_savings.deduct_annual_fee()
+        self.thor_savings.calculate_interest(1)
+
+        output = io.StringIO()
+        count = StatementExporter.to_csv(self.lnwza_bank.iter_accounts(), output,
+                                         start=datetime.now() - timedelta(days=1))
+        lines = output.getvalue().splitlines()
+        self.assertEqual(count, 3)
+        self.assertEqual(lines[0], "account_number,date,type,channel,amount,after_amount")
+        self.assertTrue(lines[1].startswith("SAV001,"))
+        self.assertTrue(lines[1].endswith(",D,ATM:001,5000,105000.0"))
+
+        output = io.StringIO()
+        count = StatementExporter.to_ndjson(self.lnwza_bank.iter_accounts(), output, types=["F", "I"])
+        rows = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(count, 2)
+        self.assertEqual([(row["account_number"], row["type"]) for row in rows],
+                         [("SAV001", "F"), ("SAV003", "I")])
+        self.assertEqual(rows[0]["channel"], "SYSTEM:")
+
+    def test_interest_engine(self): # 29. ทดสอบการคิดดอกเบี้ยแบบ batch
+        """Test the batch interest engine matches per-account interest exactly"""
+        now = datetime.now()
+        durations = [10, 200, 400]
+        expected = [SavingAccount(f"SAV1{i}", self.tony, 1234.5 * (i + 1)) for i in range(3)]
+        expected_fixed = [FixedAccount(f"FIX1{i}", self.tony, 12, 98765 + i) for i in range(3)]
+        batch = [SavingAccount(f"SAV2{i}", self.tony, 1234.5 * (i + 1)) for i in range(3)]
+        batch_fixed = [FixedAccount(f"FIX2{i}", self.tony, 12, 98765 + i) for i in range(3)]
+
+        for account in expected:
+            account.calculate_interest(1)
+        for account, days in zip(expected_fixed, durations):
+            account.deposit_date = now - timedelta(days=days)
+
+        result = InterestEngine.run(batch, [(account, now - timedelta(days=days))
+                                            for account, days in zip(batch_fixed, durations)], now)
+
+        self.assertEqual(result['accounts'], 6)
+        for one, other in zip(expected + expected_fixed, batch + batch_fixed):
+            self.assertEqual(one.get_balance, other.get_balance)
+            self.assertEqual(str(one.get_all_transaction[-1]), str(other.get_all_transaction[-1]))
+
+    def test_run_annual_fees(self): # 30. ทดสอบการหักค่าธรรมเนียมรายปีทั้งธนาคาร
+        """Test bulk annual fees with batching, progress and resume"""
+        balances = {account.get_number: account.get_balance for account in self.lnwza_bank.iter_accounts()}
+        progress = []
+
+        first = self.lnwza_bank.run_annual_fees(batch_size=2, max_batches=1,
+                                                progress=lambda done, total: progress.append((done, total)))
+        self.assertEqual(first['cursor'], 2)
+        self.assertFalse(first['done'])
+
+        second = self.lnwza_bank.run_annual_fees(batch_size=2, cursor=first['cursor'],
+                                                 progress=lambda done, total: progress.append((done, total)))
+        self.assertTrue(second['done'])
+        self.assertEqual(progress, [(2, 6), (4, 6), (6, 6)])
+        self.assertEqual(first['accounts'] + second['accounts'], 3)
+        self.assertEqual(first['fees'] + second['fees'], 150 + 300 + 300)
+
+        self.assertEqual(self.tony_savings.get_balance, balances["SAV001"] - 150)
+        self.assertEqual(self.steve_savings.get_balance, balances["SAV002"] - 300)
+        self.assertEqual(self.thanos_current.get_balance, balances["CUR001"])
+        self.assertIn("F-SYSTEM:-300-", str(self.thor_savings.get_all_transaction[-1]))
+
+    def test_edc_payment_pipeline(self): # 31. ทดสอบการชำระเงินผ่าน EDC แบบ batch
+        """Test EDC checks funds before crediting the merchant and batches merchant deposits"""
+        edc = self.lnwza_bank.get_edc_machine("EDC001")
+        merchant_initial = self.thanos_current.get_balance
+        merchant_entries = len(self.thanos_current.get_all_transaction)
+        peter_card = ShoppingDebitCard("4444-4444-4444-4444", self.peter_savings.get_number, "4444")
+        self.peter_savings.add_card(peter_card)
+
+        # Peter only has 5,000 so the merchant must not be credited
+        self.assertEqual(edc.swipe_card(peter_card, "4444"), "Success")
+        self.assertEqual(edc.pay(peter_card, 6000), "Can't transfer amount less your account")
+        self.assertEqual(self.thanos_current.get_balance, merchant_initial)
+
+        steve_initial = self.steve_savings.get_balance
+        result = edc.pay_batch([(self.steve_shopping_card, "5678", 2000),
+                                (self.thor_travel_card, "9012", 500),
+                                (peter_card, "4444", 6000),
+                                (self.tony_atm_card, "1234", 100)])
+
+        self.assertEqual(result, ["Success", "Success", "Can't transfer amount less your account",
+                                  "Error: Invalid card or PIN"])
+        self.assertEqual(self.thanos_current.get_balance, merchant_initial + 2500)
+        self.assertEqual(len(self.thanos_current.get_all_transaction), merchant_entries + 1,
+                         "One merchant deposit per batch")
+        self.assertEqual(self.steve_savings.get_balance, steve_initial - 2000 + 2000 * 0.001)
+
+    def test_merchant_settlement(self): # 32. ทดสอบการรวมยอด EDC หลายเครื่องเข้าบัญชีร้านค้า
+        """Test EDC payments are netted into one settlement deposit per merchant"""
+        settlement = MerchantSettlement(interval=3600)
+        self.lnwza_bank.set_settlement(settlement)
+        edc1 = self.lnwza_bank.get_edc_machine("EDC001")
+        edc2 = EDCMachine(self.lnwza_bank, "EDC002", self.thanos_current)
+        self.lnwza_bank.add_edc_machine(edc2)
+
+        merchant_initial = self.thanos_current.get_balance
+        merchant_entries = len(self.thanos_current.get_all_transaction)
+
+        edc1.swipe_card(self.steve_shopping_card, "5678")
+        edc1.pay(self.steve_shopping_card, 300)
+        edc2.swipe_card(self.thor_travel_card, "9012")
+        edc2.pay(self.thor_travel_card, 700)
+        edc2.pay_batch([(self.steve_shopping_card, "5678", 100)])
+
+        self.assertEqual(self.thanos_current.get_balance, merchant_initial, "Nothing posted before settlement")
+        self.assertEqual(settlement.pending_amount(self.thanos_current), 1100)
+
+        settlement_ids = settlement.settle()
+        self.assertEqual(len(settlement_ids), 1)
+        self.assertEqual(self.thanos_current.get_balance, merchant_initial + 1100)
+        self.assertEqual(len(self.thanos_current.get_all_transaction), merchant_entries + 1)
+        self.assertEqual(str(self.thanos_current.get_all_transaction[-1]),
+                         f"D-SETTLEMENT:-1100.0-{merchant_initial + 1100}")
+        self.assertEqual(settlement.receipts_of(settlement_ids[0]),
+                         [(1, "EDC001", 300.0), (2, "EDC002", 700.0), (3, "EDC002", 100.0)])
+        self.assertEqual(settlement.settle(), [])
+
+    def test_cash_forecast(self): # 33. ทดสอบการพยากรณ์เงินสดและวางแผนเติมเงินเครื่อง ATM
+        """Test forecasting when ATMs run dry and scheduling replenishment"""
+        forecaster = CashForecaster(self.lnwza_bank, capacity=10000, reserve=2000, lead_days=1)
+        flows = {"ATM001": array('d', [-3000, -3000, -3000, -3000, -3000]),
+                 "ATM002": array('d', [1000, -500, 0, 0, 0])}
+
+        self.assertEqual(forecaster.forecast(flows), {"ATM001": 2, "ATM002": None})
+
+        schedule = forecaster.schedule(flows)
+        self.assertEqual(schedule["ATM001"]['dry_day'], 2)
+        self.assertEqual(schedule["ATM001"]['refills'], [(1, 3000), (2, 3000), (3, 3000)])
+        self.assertEqual(schedule["ATM001"]['shortfalls'], [])
+        self.assertEqual(schedule["ATM002"]['refills'], [])
+
+        self.assertEqual(forecaster.replenish_due(schedule, 1), ["ATM001"])
+        self.assertEqual(self.atm1.get_balance, 13000)
+        self.assertEqual(self.atm2.get_balance, 10000)
+
+        # flow ที่เกินความจุเครื่องในวันเดียว เติมแล้วก็ยังขาด
+        refills, shortfalls = forecaster.plan(array('d', [-20000]), 10000)
+        self.assertEqual(refills, [])
+        self.assertEqual(shortfalls, [0])
+
+        synthetic = CashForecaster.synthetic_flows(["ATM001", "ATM002"], days=30)
+        self.assertEqual(len(synthetic["ATM001"]), 30)
+        self.assertEqual(set(forecaster.schedule(synthetic)), {"ATM001", "ATM002"})
+
+    def test_pin_hash_and_lockout(self): # 34. ทดสอบการเก็บ PIN แบบ hash, cache การยืนยัน และการล็อกบัตร
+        """Test salted PIN hashes, the verified-PIN cache and lockout after repeated failures"""
+        card = Card("4555-5555-5555-5555", self.peter_savings.get_number, "4321")
+        other = Card("4666-6666-6666-6666", self.peter_savings.get_number, "4321")
+        self.assertNotIn(b"4321", card.get_pin_hash)
+        self.assertNotEqual(card.get_pin_hash, other.get_pin_hash, "Each card has its own salt")
+        self.assertFalse(Card("4777-7777-7777-7777", self.peter_savings.get_number, "12a4").verify_card("12a4"))
+
+        cache = PinCache(capacity=1, ttl=60)
+        self.assertTrue(card.verify_card("4321", cache))
+        self.assertTrue(cache.check(card.get_number, "4321"))
+        self.assertFalse(cache.check(card.get_number, "0000"))
+        self.assertTrue(other.verify_card("4321", cache))
+        self.assertEqual(len(cache), 1, "Least recently used card is evicted")
+        self.assertFalse(cache.check(other.get_number, "4321", now=time.monotonic() + 61), "Entry expires after ttl")
+
+        for _ in range(Card.max_failed_attempts):
+            self.assertFalse(card.verify_card("0000", cache))
+        self.assertTrue(card.is_locked)
+        self.assertFalse(card.verify_card("4321", cache), "Locked card rejects the correct PIN")
+        self.assertEqual(self.atm1.insert_card(card, "4321"), "Error")
+
+        card.unlock()
+        self.assertTrue(card.verify_card("4321", cache))
+        self.assertEqual(card.get_failed_attempts, 0)
+
+        restored = Card(card.get_number, card.get_account_number, None)
+        restored.set_pin_hash(card.get_pin_hash)
+        self.assertTrue(restored.validate_pin("4321"))
+        self.assertFalse(restored.validate_pin("1234"))
+
+        result = PinCache.benchmark(card_count=5, rounds=2)
+        self.assertEqual(set(result), {'uncached', 'cached'})
+
+    def test_card_session(self): # 35. ทดสอบการทำหลายรายการใน session เดียวของเครื่อง ATM/EDC
+        """Test ATM and EDC sessions pin the account for several operations until eject or timeout"""
+        tony_initial = self.tony_savings.get_balance
+        steve_initial = self.steve_savings.get_balance
+
+        with self.atm1.start_session(self.tony_atm_card, "1234") as session:
+            self.assertIs(session.get_account, self.tony_savings)
+            self.assertIs(self.atm1.get_current_card, self.tony_atm_card)
+            self.assertEqual(session.deposit(1000), "Success")
+            self.assertEqual(session.withdraw(500), "Success")
+            self.assertEqual(session.transfer(self.steve_savings, 200), "Success")
+
+        self.assertIsNone(self.atm1.get_current_card, "Card is ejected when the session ends")
+        self.assertEqual(session.deposit(1000), "Error: Session closed")
+        self.assertEqual(self.tony_savings.get_balance, tony_initial + 1000 - 500 - 200)
+        self.assertEqual(self.atm1.start_session(self.tony_atm_card, "0000"), "Error")
+
+        edc = self.lnwza_bank.get_edc_machine("EDC001")
+        session = edc.start_session(self.steve_shopping_card, "5678")
+        self.assertEqual(session.pay(2000), "Success")
+        self.assertEqual(session.pay(100), "Success")
+        session.eject()
+        self.assertIsNone(edc.get_current_card)
+        self.assertEqual(self.steve_savings.get_balance, steve_initial + 200 - 2100 + 2000 * 0.001)
+
+        first = edc.start_session(self.steve_shopping_card, "5678")
+        second = edc.start_session(self.thor_travel_card, "9012")
+        self.assertEqual(first.pay(100), "Error: Card was ejected", "Another swipe ends the earlier session")
+        self.assertEqual(second.pay(100), "Success")
+        second.eject()
+
+        atm_session = self.atm1.start_session(self.tony_atm_card, "1234")
+        self.atm1.insert_card(self.steve_shopping_card, "5678")
+        self.assertEqual(atm_session.withdraw(100), "Error: Card was ejected")
+        self.atm1.eject_card()
+
+        expired = edc.start_session(self.thor_travel_card, "9012", timeout=0)
+        self.assertEqual(expired.pay(100), "Error: Session expired")
+        self.assertFalse(expired.is_active)
+        self.assertIsNone(edc.get_current_card)
+
+    def test_concurrent_journal(self): # 36. ทดสอบการบันทึก journal พร้อมกันหลาย thread
+        """Test concurrent deposits on separate accounts all reach the journal"""
+        users = [User(f"9000-{i}", f"Journal {i}") for i in range(8)]
+        accounts = [SavingAccount(f"JRN{i:03}", users[i], 0) for i in range(8)]
+        for user, account in zip(users, accounts):
+            user.add_account(account)
+            self.lnwza_bank.add_user(user)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bank.wal")
+            journal = TransactionJournal(path, batch_size=7)
+            self.lnwza_bank.set_journal(journal)
+
+            def worker(account):
+                for _ in range(2000):
+                    account.deposit("COUNTER:001", 1)
+
+            threads = [threading.Thread(target=worker, args=(account,)) for account in accounts]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(timeout=60)
+                self.assertFalse(thread.is_alive())
+
+            journal.close()
+            self.lnwza_bank.set_journal(None)
+
+            records = list(TransactionJournal.read(path))
+            self.assertEqual(len(records), 8 * 2000)
+            for account in accounts:
+                after_amounts = [record[3] for record in records if record[0] == account.get_number]
+                self.assertEqual(after_amounts, list(range(1, 2001)), "Records of one account keep their order")
+
+    def test_edc_rejects_unswiped_card(self): # 37. ทดสอบว่า EDC ไม่ตัดเงินจากบัตรที่ไม่ได้รูด
+        """Test EDC only charges the card that was swiped with its PIN"""
+        edc = self.lnwza_bank.get_edc_machine("EDC001")
+        thor_initial = self.thor_savings.get_balance
+
+        edc.swipe_card(self.steve_shopping_card, "5678")
+        self.assertEqual(edc.pay(self.thor_travel_card, 500), "Error: Card was not swiped")
+        self.assertEqual(self.thor_savings.get_balance, thor_initial)
+
+        self.assertEqual(edc.pay_batch([(self.steve_shopping_card, "5678", 100)]), ["Success"])
+        self.assertIsNone(edc.get_current_card, "Batch leaves no card in the machine")
+        self.assertEqual(edc.pay(self.steve_shopping_card, 100), "Error: No card inserted")
+
+    def test_snapshot_resave(self): # 38. ทดสอบการบันทึก snapshot จากธนาคารที่โหลดจาก snapshot
+        """Test saving a lazily restored bank keeps the accounts that were never touched"""
+        with tempfile.TemporaryDirectory() as directory:
+            first_path = os.path.join(directory, "first.snapshot")
+            second_path = os.path.join(directory, "second.snapshot")
+            self.assertEqual(BankSnapshot.save(self.lnwza_bank, first_path), "Success")
+
+            bank = Bank()
+            snapshot = BankSnapshot(first_path)
+            bank.set_snapshot(snapshot)
+            bank.find_account_from_account_number("SAV001").deposit("ATM001", 100)
+            self.assertEqual(BankSnapshot.save(bank, second_path), "Success")
+
+            reloaded = Bank()
+            second = BankSnapshot(second_path)
+            reloaded.set_snapshot(second)
+            self.assertEqual(len(second), 6)
+            self.assertEqual(sorted(account.get_number for account in reloaded.iter_accounts()),
+                             ["CUR001", "FIX001", "SAV001", "SAV002", "SAV003", "SAV004"])
+            self.assertEqual(reloaded.find_account_from_account_number("SAV001").get_balance, 100100.0)
+            self.assertEqual(reloaded.find_account_from_account_number("SAV003").get_balance, 150000.0)
+            self.assertIsInstance(reloaded.find_account_from_number("4333-3333-3333-3333").get_card, TravelDebitCard)
+
+            report = reloaded.run_annual_fees()
+            self.assertEqual(report['accounts'], 3, "Fee run covers accounts that were still in the snapshot")
+
+            snapshot.close()
+            second.close()
+
+    def test_daily_withdraw_limit(self): # 39. ทดสอบวงเงินถอนต่อบัตรแบบ rolling 24 ชั่วโมง
+        """Test the per-card daily limit spans ATMs and counters, and the tracker window, release and eviction"""
+        self.atm1.replenish(100000)
+        self.atm2.replenish(100000)
+        account = self.atm1.insert_card(self.tony_atm_card, "1234")
+
+        self.assertEqual(self.atm1.withdraw(account, 40000), "Success")
+        self.assertEqual(self.atm2.withdraw(account, 15000), "Error: Exceeds daily withdrawal limit")
+        self.assertEqual(self.counter.withdraw(account, 15000, account.get_number, self.tony.citizen_id),
+                         "Error: Exceeds daily withdrawal limit")
+        self.assertEqual(self.counter.withdraw(account, 10000, account.get_number, self.tony.citizen_id), "Success")
+        self.assertEqual(self.lnwza_bank.get_withdraw_limits.remaining(self.tony_atm_card.get_number), 0)
+
+        # ถอนไม่สำเร็จต้องคืนวงเงิน
+        steve = self.atm1.insert_card(self.steve_shopping_card, "5678")
+        self.steve_savings.set_balance = 100
+        self.assertEqual(self.atm1.withdraw(steve, 1000), "Error")
+        self.assertEqual(self.lnwza_bank.get_withdraw_limits.used(self.steve_shopping_card.get_number), 0)
+
+        hour = 3600
+        tracker = WithdrawLimitTracker(ATMMachine.max_withdraw)
+        self.assertTrue(tracker.consume("A", 30000, now=0))
+        self.assertFalse(tracker.consume("A", 30000, now=hour))
+        self.assertTrue(tracker.consume("A", 20000, now=hour))
+        tracker.release("A", 20000, now=hour)
+        self.assertEqual(tracker.used("A", now=hour), 30000)
+        self.assertEqual(tracker.used("A", now=24 * hour), 0, "Usage leaves the window after 24 hours")
+        self.assertTrue(tracker.consume("A", 50000, now=24 * hour))
+
+        tracker.consume("B", 100, now=30 * hour)
+        self.assertEqual(len(tracker), 2)
+        tracker.consume("C", 100, now=49 * hour)
+        self.assertEqual(len(tracker), 2, "Card A idle for a full window is evicted")
+        tracker.consume("C", 100, now=60 * hour)
+        self.assertEqual(len(tracker), 1)
+
+    def test_run_annual_fees_resume_after_failure(self): # 40. ทดสอบการรันค่าธรรมเนียมรายปีซ้ำหลังล้มกลาง batch
+        """Test resuming a failed fee run charges every account exactly once"""
+        class BrokenCard(Card):
+            __slots__ = ()
+
+            @property
+            def annual_fee(self):
+                raise RuntimeError("fee service unavailable")
+
+        good_card = Card("4444-0000-0000-0000", self.peter_savings.get_number, "4444")
+        self.peter_savings.add_card(BrokenCard("4444-1111-1111-1111", self.peter_savings.get_number, "4444"))
+        balances = {account.get_number: account.get_balance for account in self.lnwza_bank.iter_accounts()}
+
+        with self.assertRaises(RuntimeError):
+            self.lnwza_bank.run_annual_fees(batch_size=10, period=2026)
+        self.assertEqual(self.tony_savings.get_balance, balances["SAV001"] - 150, "Charged before the failure")
+
+        # เพิ่มบัญชีระหว่างรอบ ทำให้ลำดับบัญชีเลื่อน
+        steve_second = SavingAccount("SAV005", self.steve, 1000)
+        self.steve.add_account(steve_second)
+        steve_second.add_card(Card("4555-0000-0000-0000", "SAV005", "1111"))
+        self.peter_savings.add_card(good_card)
+
+        report = self.lnwza_bank.run_annual_fees(batch_size=10, period=2026)
+        self.assertTrue(report['done'])
+        self.assertEqual(report['accounts'], 2, "Only Peter's and the new account are charged on resume")
+        self.assertEqual(self.tony_savings.get_balance, balances["SAV001"] - 150)
+        self.assertEqual(self.steve_savings.get_balance, balances["SAV002"] - 300)
+        self.assertEqual(self.thor_savings.get_balance, balances["SAV003"] - 300)
+        self.assertEqual(self.peter_savings.get_balance, balances["SAV004"] - 150)
+        self.assertEqual(steve_second.get_balance, 1000 - 150)
+
+        self.assertEqual(self.lnwza_bank.run_annual_fees(period=2026)['accounts'], 0)
+        self.assertEqual(self.lnwza_bank.run_annual_fees(period=2027)['accounts'], 5)
+
+    def test_ledger_shared_tables(self): # 41. ทดสอบตารางช่องทางที่ใช้ร่วมกันและการกรองชนิดที่ไม่รู้จัก
+        """Test ledgers share the channel table and unknown filter types are not registered"""
+        first = TransactionLedger()
+        second = TransactionLedger()
+        first.record("D", 100, 100, "ATM777")
+        second.record("W", 50, 50, "ATM777")
+        self.assertEqual(first.channel_ids[0], second.channel_ids[0])
+        self.assertEqual(second.channel_names, ["ATM777"])
+
+        self.assertEqual(list(first.entries(types=["X-TYPO"])), [])
+        self.assertIsNone(TransactionLedger.find_type_code("X-TYPO"), "Filtering does not register a new type")
+        self.assertEqual(len(list(first.entries(types=["D", "X-TYPO"]))), 1)
+
+        empty = TransactionLedger()
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(empty.channel_names, [])
+        self.assertEqual(len(TransactionLedger().amounts), 0, "Empty ledgers stay empty after another ledger records")
+
+    def test_settlement_retention(self): # 42. ทดสอบการจำกัดจำนวนใบเสร็จของ settlement ที่เก็บไว้
+        """Test settled receipts are bounded by retain and can be pruned"""
+        settlement = MerchantSettlement(interval=3600, retain=2)
+        settlement_ids = []
+
+        for amount in (100, 200, 300):
+            settlement.add(self.thanos_current, "EDC001", amount)
+            settlement_ids += settlement.settle()
+
+        self.assertEqual(settlement.receipts_of(settlement_ids[0]), [], "Oldest settlement is dropped")
+        self.assertEqual(settlement.receipts_of(settlement_ids[2]), [(3, "EDC001", 300.0)])
+
+        self.assertEqual(settlement.prune(settlement_ids[2]), 1)
+        self.assertEqual(settlement.receipts_of(settlement_ids[1]), [])
+        self.assertEqual(settlement.receipts_of(settlement_ids[2]), [(3, "EDC001", 300.0)])
+
+    def test_async_account_serialization(self): # 43. ทดสอบว่า AsyncChannel ทำรายการของบัญชีและเครื่องเดียวกันทีละรายการ
+        """Test async operations on one account or one machine are serialized while others run in parallel"""
+        active = {}
+        peak = {}
+        stats_lock = threading.Lock()
+
+        class SlowChannel:
+            def __init__(self, name):
+                self.name = name
+
+            def deposit(self, account, amount):
+                keys = (account.get_number, self.name, 'total')
+                with stats_lock:
+                    for key in keys:
+                        active[key] = active.get(key, 0) + 1
+                        peak[key] = max(peak.get(key, 0), active[key])
+                time.sleep(0.01)
+                with stats_lock:
+                    for key in keys:
+                        active[key] -= 1
+                return "Success"
+
+        locks = AsyncAccountLock()
+        terminals = [AsyncChannel(SlowChannel("T1"), locks), AsyncChannel(SlowChannel("T2"), locks)]
+
+        async def run():
+            jobs = [(terminals[i % 2], account) for i in range(4)
+                    for account in (self.tony_savings, self.steve_savings)]
+            return await asyncio.gather(*(terminal.deposit(account, 1) for terminal, account in jobs))
+
+        self.assertEqual(asyncio.run(run()), ["Success"] * 8)
+        self.assertEqual(peak["SAV001"], 1, "Same account never runs concurrently")
+        self.assertEqual(peak["SAV002"], 1)
+        self.assertEqual(peak["T1"], 1, "Same machine never runs concurrently")
+        self.assertEqual(peak["T2"], 1)
+        self.assertEqual(peak['total'], 2, "Different accounts on different machines run at the same time")
+
+    def test_register_channel_subclass(self): # 44. ทดสอบว่า subclass ของ ATMMachine ถูกลงทะเบียนรวมกับ ATMMachine
+        """Test an ATMMachine subclass is found through get_atm_machine and channels_of(ATMMachine)"""
+        class DriveThroughATM(ATMMachine):
+            pass
+
+        atm = DriveThroughATM(self.lnwza_bank, "ATM-DT1", 100000)
+        self.assertEqual(self.lnwza_bank.add_atm_machine(atm), "Success")
+        self.assertIs(self.lnwza_bank.get_atm_machine("ATM-DT1"), atm)
+        self.assertIn(atm, list(self.lnwza_bank.get_channels.channels_of(ATMMachine)))
+        self.assertIs(self.lnwza_bank.get_channels.get(DriveThroughATM, "ATM-DT1"), atm)
+        self.assertEqual(self.lnwza_bank.get_channels.unregister(DriveThroughATM, "ATM-DT1"), "Success")
+        self.assertIsNone(self.lnwza_bank.get_atm_machine("ATM-DT1"))
+
+    def test_async_atm_cash_never_negative(self): # 45. ทดสอบว่าถอนเงินพร้อมกันหลายบัญชีที่ ATM เดียว เงินในตู้ไม่ติดลบ
+        """Test concurrent async withdrawals from different accounts cannot overdraw one ATM"""
+        self.lnwza_bank.set_withdraw_limits(WithdrawLimitTracker(float('inf')))
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for _ in range(20):
+                atm = ATMMachine(self.lnwza_bank, "ATM-RACE", 1000)
+                terminal = AsyncChannel(atm)
+
+                async def run():
+                    return await asyncio.gather(terminal.withdraw(self.tony_savings, 1000),
+                                                terminal.withdraw(self.steve_savings, 1000))
+
+                results = asyncio.run(run())
+                self.assertEqual(sorted(results), ["ATM has insufficient funds", "Success"])
+                self.assertEqual(atm.get_balance, 0)
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+    def test_journal_wait_outside_account_lock(self): # 46. ทดสอบว่าการรอ fsync ของ journal ไม่ถือ lock บัญชีไว้
+        """Test a deposit waiting for its group commit does not block other work on the account stripe"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bank.wal")
+            journal = TransactionJournal(path, batch_size=1000, max_delay=0.5)
+            self.lnwza_bank.set_journal(journal)
+
+            depositor = threading.Thread(target=self.tony_savings.deposit, args=("COUNTER:001", 100))
+            depositor.start()
+            time.sleep(0.05)
+
+            start = time.perf_counter()
+            with account_locks.hold(self.tony_savings.get_number):
+                waited = time.perf_counter() - start
+
+            self.assertTrue(depositor.is_alive(), "Deposit is still waiting for the group commit")
+            self.assertLess(waited, 0.25, "Account stripe is free while the deposit waits")
+
+            depositor.join(timeout=5)
+            journal.close()
+            self.lnwza_bank.set_journal(None)
+            self.assertEqual(len(list(TransactionJournal.read(path))), 1)
+
+    def test_fee_period_survives_restore(self): # 47. ทดสอบว่า period ค่าธรรมเนียมถูกกู้คืนจาก snapshot และ journal
+        """Test annual fees are not charged twice after a snapshot restore or a journal replay"""
+        with tempfile.TemporaryDirectory() as directory:
+            wal_path = os.path.join(directory, "bank.wal")
+            snapshot_path = os.path.join(directory, "bank.snapshot")
+            journal = TransactionJournal(wal_path)
+            self.lnwza_bank.set_journal(journal)
+
+            charged = self.lnwza_bank.run_annual_fees(period=2026)['accounts']
+            journal.close()
+            self.lnwza_bank.set_journal(None)
+            self.assertGreater(charged, 0)
+
+            self.assertEqual(BankSnapshot.save(self.lnwza_bank, snapshot_path), "Success")
+            bank = Bank()
+            snapshot = BankSnapshot(snapshot_path)
+            bank.set_snapshot(snapshot)
+            balances = {account.get_number: account.get_balance for account in bank.iter_accounts()}
+
+            self.assertEqual(bank.run_annual_fees(period=2026)['accounts'], 0, "Snapshot keeps the fee period")
+            self.assertEqual({account.get_number: account.get_balance for account in bank.iter_accounts()}, balances)
+            snapshot.close()
+
+            bank = Bank()
+            tony = User("1111-1111-1111", "Tony Stark")
+            bank.add_user(tony)
+            tony_savings = SavingAccount("SAV001", tony, 100000.00)
+            tony.add_account(tony_savings)
+            TransactionJournal.replay(wal_path, bank)
+
+            self.assertEqual(tony_savings.get_fee_period, 2026, "Replay restores the fee period")
+            self.assertEqual(tony_savings.charge_fee(100, period=2026), "Error: fee already charged for period")
+
+    def test_settlement_timer(self): # 48. ทดสอบการ settle อัตโนมัติเมื่อครบ interval โดยไม่มีรายการใหม่
+        """Test the settlement timer posts a quiet period and settlements share one channel name"""
+        settlement = MerchantSettlement(interval=0.05)
+        self.lnwza_bank.set_settlement(settlement)
+        edc = self.lnwza_bank.get_edc_machine("EDC001")
+        merchant_initial = self.thanos_current.get_balance
+
+        settlement.start()
+        try:
+            for amount in (100, 200):
+                edc.swipe_card(self.steve_shopping_card, "5678")
+                edc.pay(self.steve_shopping_card, amount)
+
+                deadline = time.monotonic() + 5
+                while settlement.pending_amount(self.thanos_current) != 0 and time.monotonic() < deadline:
+                    time.sleep(0.01)
+        finally:
+            settlement.stop()
+
+        self.assertEqual(self.thanos_current.get_balance, merchant_initial + 300,
+                         "Payments are posted without another add() or settle() call")
+        settlement_channels = [name for name in self.thanos_current.get_all_transaction.channel_names
+                               if str(name).startswith("SETTLEMENT")]
+        self.assertEqual(settlement_channels, ["SETTLEMENT"])
+
+    def test_pin_cache_reissued_card(self): # 49. ทดสอบว่าบัตรที่ออกใหม่หรือเปลี่ยน PIN ไม่รับ PIN เก่าจาก cache
+        """Test a reissued card or a replaced PIN hash does not accept the cached old PIN"""
+        card = Card("4888-8888-8888-8888", self.peter_savings.get_number, "1111")
+        self.assertTrue(card.verify_card("1111"))
+
+        reissued = Card("4888-8888-8888-8888", self.peter_savings.get_number, "2222")
+        self.assertFalse(reissued.verify_card("1111"), "Old PIN is not served from the cache")
+        self.assertTrue(reissued.verify_card("2222"))
+
+        reissued.set_pin_hash(Card("TEMP", self.peter_savings.get_number, "3333").get_pin_hash)
+        self.assertFalse(reissued.verify_card("2222"), "Cache entry is dropped when the PIN hash changes")
+        self.assertTrue(reissued.verify_card("3333"))
+
+    def test_ledger_many_types(self): # 50. ทดสอบว่า ledger รองรับชนิด transaction เกิน 256 ชนิด
+        """Test the ledger keeps working past 256 distinct transaction types"""
+        ledger = TransactionLedger()
+        types = [f"T{i}" for i in range(300)]
+        for amount, type in enumerate(types):
+            ledger.record(type, amount, amount)
+
+        self.assertEqual(len(ledger), 300)
+        self.assertEqual([ledger.type_name(i) for i in range(300)], types)
+        self.assertEqual(ledger[-1].get_type, "T299")
+
+    def test_abandoned_session_releases_card(self): # 51. ทดสอบว่า session ที่ถูกทิ้งไว้คืนบัตรเมื่อหมดเวลา
+        """Test an abandoned session releases its card once the timeout passes, without another session call"""
+        atm_session = self.atm1.start_session(self.tony_atm_card, "1234", timeout=0.05)
+        edc = self.lnwza_bank.get_edc_machine("EDC001")
+        edc_session = edc.start_session(self.steve_shopping_card, "5678", timeout=0.05)
+        self.assertIs(self.atm1.get_current_card, self.tony_atm_card)
+        self.assertIs(edc.get_current_card, self.steve_shopping_card)
+
+        time.sleep(0.1)
+
+        self.assertIsNone(self.atm1.get_current_card, "Timed out session leaves no card in the ATM")
+        self.assertIsNone(edc.get_current_card)
+        self.assertFalse(atm_session.is_active)
+        self.assertFalse(edc_session.is_active)
+        self.assertEqual(edc.pay(self.steve_shopping_card, 100), "Error: No card inserted")
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()